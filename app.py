@@ -4,30 +4,36 @@ os.environ['TOKENIZERS_PARALLELISM'] = 'false'
 import flet as ft
 import subprocess
 import threading
-import numpy as np
-import json
 from PIL import Image
-from send2trash import send2trash
-from core.indexer import build_master_index
-from core.search_logic import perform_ultimate_search
-from core.cleaner_logic import find_duplicates
-from core.face_logic import load_known_faces, save_known_face
+from core.face_logic import save_known_face, match_known_faces, update_face_clusters, list_face_clusters, cluster_samples
+from core.index_store import get_store
 import sys
-import hashlib
+# core.indexer, core.search_logic, core.cleaner_logic and core.watcher pull in torch,
+# sentence_transformers, dlib and tesseract, so they are imported where first used
+# (search is warmed up in the background) and the window opens without waiting on them.
 
 # --- CONFIGURATION ---
 APP_DIR = os.path.join(os.path.expanduser("~"), ".screenscorch")
-MASTER_INDEX_FILE = os.path.join(APP_DIR, "master_index.json")
+
+SEARCH_DEBOUNCE_SECONDS = 0.3 # Search-as-you-type waits for a pause in typing
+MIN_TYPED_QUERY_LENGTH = 2
 
 # A lock to make UI updates from threads safe
 ui_lock = threading.Lock()
 
+def run_indexer(*args, **kwargs):
+    from core.indexer import build_master_index
+    build_master_index(*args, **kwargs)
+
 class ScreenScorchApp(ft.Stack):
     def __init__(self):
         super().__init__()
         self.expand = True
         self.cleaner_checkboxes = []
         self.untagged_faces_cache = []
+        self.folder_watcher = None
+        self.search_cancel_event = None
+        self.search_debounce_timer = None
 
     def build(self):
         # --- EMPTY STATE VIEW ---
@@ -48,7 +54,7 @@ class ScreenScorchApp(ft.Stack):
         )
 
         # --- MAIN APPLICATION VIEW ---
-        self.search_field = ft.TextField(hint_text="Search by text, content, or a tagged person...", expand=True, on_submit=self.handle_search)
+        self.search_field = ft.TextField(hint_text="Search by text, content, or a tagged person...", expand=True, on_submit=self.handle_search, on_change=self.handle_search_typing)
         self.search_button = ft.IconButton(icon="search", on_click=self.handle_search)
         self.results_list = ft.ListView(expand=True, spacing=5, auto_scroll=False)
         
@@ -72,10 +78,11 @@ class ScreenScorchApp(ft.Stack):
         
         self.cleaner_results_view = ft.ListView(expand=True, spacing=15, auto_scroll=False)
         self.delete_selected_button = ft.ElevatedButton("Move Selected to Trash", icon="delete_sweep", color="white", bgcolor="red600", on_click=self.delete_selected_files, height=40)
-        self.cleaner_view = ft.Column(controls=[ft.Text("Duplicate & Near-Duplicate Files", size=20, weight=ft.FontWeight.BOLD),ft.Text("Review groups and check files to delete.", color="grey500"), ft.Divider(),self.cleaner_results_view, ft.Container(content=self.delete_selected_button, alignment=ft.alignment.center)], visible=False, expand=True)
+        self.rescan_button = ft.TextButton("Rescan fully", icon="refresh", on_click=lambda e: self.run_cleaner_scan(full=True), tooltip="Re-hash and regroup every file instead of only the changed ones")
+        self.cleaner_view = ft.Column(controls=[ft.Row([ft.Text("Duplicate & Near-Duplicate Files", size=20, weight=ft.FontWeight.BOLD), self.rescan_button], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),ft.Text("Review groups and check files to delete.", color="grey500"), ft.Divider(),self.cleaner_results_view, ft.Container(content=self.delete_selected_button, alignment=ft.alignment.center)], visible=False, expand=True)
 
         self.people_grid_view = ft.GridView(expand=True, max_extent=150, child_aspect_ratio=1.0, spacing=10, run_spacing=10)
-        self.people_view = ft.Column(controls=[ft.Text("Untagged Faces", size=20, weight=ft.FontWeight.BOLD),ft.Text("Click on a face to assign a name. This name can then be used in search.", color="grey500"), ft.Divider(),self.people_grid_view], visible=False, expand=True)
+        self.people_view = ft.Column(controls=[ft.Text("Untagged Faces", size=20, weight=ft.FontWeight.BOLD),ft.Text("Each card groups one person's faces. Click it to assign a name; the name then works in search.", color="grey500"), ft.Divider(),self.people_grid_view], visible=False, expand=True)
 
         self.status_bar = ft.Text("Ready.", size=12)
         self.search_nav_button = ft.TextButton(text="Search", icon="search", data=0, on_click=self.handle_view_change, style=ft.ButtonStyle(bgcolor="white10"))
@@ -119,16 +126,24 @@ class ScreenScorchApp(ft.Stack):
 
     def check_initial_state(self):
         try:
-            if os.path.exists(MASTER_INDEX_FILE) and os.path.getsize(MASTER_INDEX_FILE) > 2:
-                with open(MASTER_INDEX_FILE, 'r') as f: data = json.load(f)
-                if data:
-                    self.show_main_view()
-                else: raise FileNotFoundError
-            else: raise FileNotFoundError
-        except (FileNotFoundError, json.JSONDecodeError):
+            if get_store(self.update_status).count() > 0: # A COUNT(*) on the index, not a full load
+                self.show_main_view()
+                self.warm_up_search()
+            else: self.show_empty_view()
+        except Exception:
             self.show_empty_view()
         self.update()
 
+    def warm_up_search(self):
+        # Loads the search modules, CLIP model and index caches while the user looks at the window
+        def thread_target():
+            try:
+                from core.search_logic import load_index_and_model_if_needed
+                load_index_and_model_if_needed()
+            except Exception as e:
+                print(f"⚠️ Search warm-up failed: {e}")
+        threading.Thread(target=thread_target, daemon=True).start()
+
     # UX FIX: New helper functions to manage view states
     def show_empty_view(self):
         self.main_app_view.visible = False
@@ -173,17 +188,35 @@ class ScreenScorchApp(ft.Stack):
 
             def on_indexing_complete():
                 # This function will be called by the indexer thread when it finishes
+                if self.folder_watcher: self.start_folder_watcher() # Pick up the newly imported root
                 self.progress_view.visible = False
                 self.results_list.visible = True
                 if self.page:
                     self.page.update()
 
             thread = threading.Thread(
-                target=build_master_index, 
+                target=run_indexer, 
                 args=(selected_path, on_indexing_complete, self.update_status)
             )
             thread.start()
 
+    def rescan_imported_folders(self, e):
+        """Re-stats every file in the imported folders, catching edits made in place that the quick scan skips."""
+        roots = get_store().imported_roots()
+        if not roots:
+            self.update_status("Import a folder first to rescan it.")
+            return
+        self.show_main_view(show_progress=True)
+        self.update()
+
+        def rescan_thread_target():
+            for root in roots:
+                run_indexer(root, None, self.update_status, full_rescan=True)
+            self.progress_view.visible = False
+            self.results_list.visible = True
+            if self.page: self.page.update()
+        threading.Thread(target=rescan_thread_target).start()
+
     def close_folder_browser(self, e):
         self.folder_browser_view.visible = False
         self.update()
@@ -227,13 +260,36 @@ class ScreenScorchApp(ft.Stack):
                     on_indexing_complete()
                     return
                 self.update_status(f"Found {len(all_image_paths)} images. Starting indexer...")
-                build_master_index(all_image_paths, on_indexing_complete, self.update_status)
+                run_indexer(all_image_paths, on_indexing_complete, self.update_status)
             except Exception as ex:
                 self.update_status(f"❌ An error occurred during full scan: {ex}")
                 on_indexing_complete()
         
         threading.Thread(target=thread_target).start()
         
+    # --- WATCH MODE LOGIC ---
+    def toggle_watch_mode(self, e):
+        if self.folder_watcher:
+            self.folder_watcher.stop()
+            self.folder_watcher = None
+            self.update_status("Watch mode off.")
+        else:
+            self.start_folder_watcher()
+        e.control.checked = self.folder_watcher is not None
+        if self.page: self.page.update()
+
+    def start_folder_watcher(self):
+        if self.folder_watcher: self.folder_watcher.stop()
+        roots = get_store().imported_roots()
+        if not roots:
+            self.folder_watcher = None
+            self.update_status("Import a folder first to watch it for new images.")
+            return
+        from core.watcher import FolderWatcher
+        self.folder_watcher = FolderWatcher(roots, self.update_status)
+        if not self.folder_watcher.start():
+            self.folder_watcher = None
+
     def open_tag_dialog(self, face_data):
         self.current_face_data = face_data
         self.dialog_face_image.src = face_data['face_chip_path']
@@ -248,8 +304,10 @@ class ScreenScorchApp(ft.Stack):
     def save_tag(self, e):
         name = self.dialog_name_field.value.strip()
         if name and hasattr(self, 'current_face_data'):
-            save_known_face(name, self.current_face_data['embedding'])
-            self.update_status(f"✅ Saved '{name}'. Re-scanning faces...")
+            store = get_store()
+            save_known_face(name, cluster_samples(store, self.current_face_data['cluster_id'])) # Several samples improve recall
+            store.name_face_cluster(self.current_face_data['cluster_id'], name.lower()) # Tags every face in the group
+            self.update_status(f"✅ Saved '{name}' for {self.current_face_data['size']} faces. Re-scanning faces...")
             self.find_and_display_untagged_faces()
         self.face_tag_dialog.visible = False
         self.update()
@@ -272,41 +330,42 @@ class ScreenScorchApp(ft.Stack):
         self.update()
 
     def create_face_card(self, face_data):
-        return ft.Container(content=ft.Card(elevation=4, content=ft.Image(src=face_data['face_chip_path'], border_radius=ft.border_radius.all(8), fit=ft.ImageFit.COVER, width=150, height=150)), on_click=lambda e: self.open_tag_dialog(face_data), ink=True, border_radius=ft.border_radius.all(8))
+        face_image = ft.Image(src=face_data['face_chip_path'], border_radius=ft.border_radius.all(8), fit=ft.ImageFit.COVER, width=150, height=150)
+        count_badge = ft.Container(content=ft.Text(f"{face_data['size']} faces", size=12), bgcolor="#99000000", padding=ft.padding.symmetric(horizontal=6, vertical=2), border_radius=ft.border_radius.all(6), right=6, bottom=6)
+        return ft.Container(content=ft.Card(elevation=4, content=ft.Stack([face_image, count_badge])), on_click=lambda e: self.open_tag_dialog(face_data), ink=True, border_radius=ft.border_radius.all(8))
     
     def find_and_display_untagged_faces(self):
         self.people_grid_view.controls.clear()
         self.update_status("Scanning for untagged faces...")
         def thread_target():
             try:
-                with open(MASTER_INDEX_FILE, 'r') as f: master_index = json.load(f)
-                known_face_names, known_face_embeddings = load_known_faces()
-                temp_untagged_faces = []
-                for item in master_index:
-                    if not item.get('face_embeddings'): continue
-                    for i, face_embedding in enumerate(item['face_embeddings']):
-                        is_known = False
-                        if known_face_embeddings:
-                            matches = np.linalg.norm(np.array(known_face_embeddings) - np.array(face_embedding), axis=1) <= 0.6
-                            if np.any(matches): is_known = True
-                        if not is_known:
-                            temp_untagged_faces.append({"item_data": item, "face_index": i, "embedding": face_embedding})
+                store = get_store()
+                update_face_clusters(store, status_callback=self.update_status) # Normally already done by the indexer
+                # One card per untagged person: clusters with no name whose representative matches no known face
+                untagged_clusters = [cluster for cluster in list_face_clusters(store) if cluster['name'] is None]
+                known_names = match_known_faces([cluster['embedding'] for cluster in untagged_clusters])
+                untagged_clusters = [cluster for cluster, known_name in zip(untagged_clusters, known_names) if known_name is None]
+                faces = store.get_faces([cluster['face_id'] for cluster in untagged_clusters])
                 new_face_cache = []
-                for face_data in temp_untagged_faces:
-                    item, i = face_data['item_data'], face_data['face_index']
-                    thumb_img = Image.open(item['thumbnail_path'])
-                    face_locations = item.get('face_locations', [])
-                    if i < len(face_locations):
-                        top, right, bottom, left = face_locations[i]
-                        orig_w, orig_h = item['width'], item['height']
-                        thumb_w, thumb_h = thumb_img.size
-                        x_scale, y_scale = thumb_w / orig_w, thumb_h / orig_h
-                        thumb_coords = (int(left * x_scale), int(top * y_scale), int(right * x_scale), int(bottom * y_scale))
-                        face_chip = thumb_img.crop(thumb_coords)
-                        face_chip_filename = f"{hashlib.md5(item['file_path'].encode()).hexdigest()}_face_{i}.jpeg"
-                        face_chip_path = os.path.join(APP_DIR, "thumbnails", face_chip_filename)
-                        face_chip.save(face_chip_path, "JPEG")
-                        new_face_cache.append({"face_chip_path": face_chip_path, "embedding": face_data['embedding']})
+                for cluster in untagged_clusters:
+                    face = faces.get(cluster['face_id'])
+                    if not face: continue
+                    face_chip_path = face['chip_path']
+                    if not face_chip_path or not os.path.exists(face_chip_path):
+                        # Faces indexed before chips were cached: cut the chip once and remember it
+                        if face['top'] is None: continue
+                        from core.indexer import FACE_CHIP_DIR
+                        from core.image_analysis import save_face_chip
+                        os.makedirs(FACE_CHIP_DIR, exist_ok=True)
+                        try:
+                            with Image.open(face['file_path']) as source_img:
+                                location = (face['top'], face['right'], face['bottom'], face['left'])
+                                face_chip_path = save_face_chip(source_img.convert('RGB'), location, FACE_CHIP_DIR)
+                        except OSError:
+                            continue # Source file is gone; the indexer will drop it
+                        store.set_face_chip(face['id'], face_chip_path)
+                    new_face_cache.append({"face_chip_path": face_chip_path, "embedding": cluster['embedding'],
+                                           "cluster_id": cluster['cluster_id'], "size": cluster['size']})
                 self.display_face_chips(new_face_cache)
             except Exception as e:
                 self.update_status(f"❌ Error scanning faces: {e}")
@@ -321,25 +380,54 @@ class ScreenScorchApp(ft.Stack):
                 self.people_grid_view.controls.append(ft.Container(content=message, alignment=ft.alignment.center, expand=True))
             else:
                 for face_data in self.untagged_faces_cache: self.people_grid_view.controls.append(self.create_face_card(face_data))
-            self.status_bar.value = f"Displaying {len(self.untagged_faces_cache)} untagged faces."
+            self.status_bar.value = f"Displaying {len(self.untagged_faces_cache)} untagged people."
             if self.page: self.page.update()
     
+    def handle_search_typing(self, e):
+        # Restart the debounce timer on every keystroke; the search runs once typing pauses
+        if self.search_debounce_timer: self.search_debounce_timer.cancel()
+        if len(self.search_field.value.strip()) < MIN_TYPED_QUERY_LENGTH: return
+        self.search_debounce_timer = threading.Timer(SEARCH_DEBOUNCE_SECONDS, self.handle_search)
+        self.search_debounce_timer.daemon = True
+        self.search_debounce_timer.start()
+
     def handle_search(self, e=None, rerun=False):
+        if self.search_debounce_timer: self.search_debounce_timer.cancel()
         query = self.search_field.value if not rerun else getattr(self.search_field, 'last_query', '')
         if not query: return
+        if query == getattr(self.search_field, 'last_query', None) and e is None and not rerun: return # Typing paused on the same text
         self.search_field.last_query = query
-        self.update_status(f"Searching for '{query}'...")
-        results = perform_ultimate_search(query)
+        # A newer query cancels the one still running; each runs on its own worker thread
+        if self.search_cancel_event: self.search_cancel_event.set()
+        cancel_event = self.search_cancel_event = threading.Event()
         with ui_lock:
             self.results_list.controls.clear()
-            if isinstance(results, dict) and "error" in results:
-                self.status_bar.value = f"❌ Error: {results['error']}"
-            elif not results:
-                self.status_bar.value = f"🤷 No results found for '{query}'."
-            else:
-                for res in results: self.results_list.controls.append(self.create_search_result_row(res))
-                self.status_bar.value = f"✅ Found {len(results)} results."
-            self.page.update()
+            self.status_bar.value = f"Searching for '{query}'..."
+            if self.page: self.page.update()
+
+        def thread_target():
+            result_count = 0
+            try:
+                from core.search_logic import search_in_tiers
+                for tier, results in search_in_tiers(query, cancel_event=cancel_event):
+                    with ui_lock:
+                        if cancel_event.is_set(): return
+                        if tier == "error":
+                            self.status_bar.value = f"❌ Error: {results}"
+                            self.page.update()
+                            return
+                        # Rows appear tier by tier: exact keyword hits first, then fuzzy, then visual
+                        for res in results: self.results_list.controls.append(self.create_search_result_row(res))
+                        result_count += len(results)
+                        self.status_bar.value = f"Found {result_count} results so far..."
+                        self.page.update()
+                with ui_lock:
+                    if cancel_event.is_set(): return
+                    self.status_bar.value = f"✅ Found {result_count} results." if result_count else f"🤷 No results found for '{query}'."
+                    self.page.update()
+            except Exception as ex:
+                self.update_status(f"❌ Error searching: {ex}")
+        threading.Thread(target=thread_target, daemon=True).start()
 
     def create_search_result_row(self, result_data):
         return ft.Container(content=ft.Row(controls=[ft.Image(src=result_data.get('thumbnail_path'), width=70, height=70, fit=ft.ImageFit.CONTAIN, border_radius=ft.border_radius.all(6)),ft.Column([ft.Text(os.path.basename(result_data['file_path']), size=14, weight=ft.FontWeight.BOLD),ft.Text(f"Match: {result_data['match_type']} ({result_data['score']})", size=12, color="grey400"),], expand=True, spacing=2),ft.IconButton(icon="folder_open", on_click=lambda e, p=result_data['file_path']: self.open_file_in_finder(e, p), tooltip="Show in Finder"),ft.IconButton(icon="delete", on_click=lambda e, p=result_data['file_path']: self.move_to_trash(e, p), tooltip="Move to Trash"),], alignment=ft.MainAxisAlignment.START, vertical_alignment=ft.CrossAxisAlignment.CENTER),on_click=lambda e, p=result_data['file_path']: subprocess.run(['open', p]),padding=ft.padding.symmetric(vertical=5, horizontal=10), border_radius=ft.border_radius.all(8), ink=True)
@@ -348,34 +436,48 @@ class ScreenScorchApp(ft.Stack):
         if os.path.exists(path): subprocess.run(["open", "-R", path])
 
     def move_to_trash(self, e, path):
-        if os.path.exists(path):
-            try:
-                send2trash(path)
-                self.update_status(f"🗑️ Moved to Trash: {os.path.basename(path)}")
-                if self.cleaner_view.visible: self.run_cleaner_scan() 
-                else: self.handle_search(rerun=True)
-            except Exception as ex:
-                self.update_status(f"❌ Error moving to Trash: {ex}")
-        
+        self.trash_paths([path])
+
+    def trash_paths(self, paths):
+        """Trashes the files and updates the index in one batch off the UI thread, then refreshes the view once."""
+        def trash_thread_target():
+            from core.indexer import trash_files
+            trashed, errors = trash_files(paths, self.update_status)
+            if errors:
+                more = f" (and {len(errors) - 1} more)" if len(errors) > 1 else ""
+                message = f"❌ Error moving to Trash: {errors[0][1]}{more}"
+            elif len(trashed) == 1:
+                message = f"🗑️ Moved to Trash: {os.path.basename(trashed[0])}"
+            else:
+                message = f"✅ Moved {len(trashed)} files to Trash."
+            self.update_status(message)
+            if not trashed: return
+            # The one refresh ends on the trash result rather than replacing it
+            if self.cleaner_view.visible: self.run_cleaner_scan(done_message=message)
+            else: self.handle_search(rerun=True)
+        threading.Thread(target=trash_thread_target, daemon=True).start()
+
     def delete_selected_files(self, e):
         files_to_delete = [cb.data for cb in self.cleaner_checkboxes if cb.value]
         if not files_to_delete:
             self.update_status("No files selected to delete.")
             return
-        for path in files_to_delete: self.move_to_trash(None, path)
-        self.update_status(f"✅ Moved {len(files_to_delete)} files to Trash.")
-        self.run_cleaner_scan()
+        self.update_status(f"Moving {len(files_to_delete)} files to Trash...")
+        self.trash_paths(files_to_delete)
 
-    def run_cleaner_scan(self):
+    def run_cleaner_scan(self, full=False, done_message="✅ Duplicate scan complete."):
         self.cleaner_checkboxes.clear()
         self.cleaner_results_view.controls.clear()
-        self.update_status("Starting duplicate scan...")
+        self.update_status("Starting full duplicate scan..." if full else "Loading duplicate groups...")
         self.page.update()
         def on_scan_complete(dupes):
             with ui_lock:
                 self.cleaner_results_view.controls.clear()
-                if dupes is None: return
-                if not dupes["exact"] and not dupes["near"]:
+                if dupes is None: # find_duplicates has already put the reason in the status bar
+                    self.cleaner_results_view.controls.append(ft.Text("Couldn't scan for duplicates. See the status bar for details.", italic=True, text_align=ft.TextAlign.CENTER))
+                    if self.page: self.page.update()
+                    return
+                if not dupes["exact"] and not dupes["near"] and not dupes["semantic"]:
                     self.cleaner_results_view.controls.append(ft.Text("No duplicates found!", italic=True, text_align=ft.TextAlign.CENTER))
                 def create_file_row(file_obj, is_checked):
                     cb = ft.Checkbox(value=is_checked, data=file_obj['file_path'])
@@ -387,14 +489,22 @@ class ScreenScorchApp(ft.Stack):
                         group_col = ft.Column([create_file_row(file, i > 0) for i, file in enumerate(group)])
                         self.cleaner_results_view.controls.append(ft.Card(content=ft.Container(group_col, padding=10)))
                 if dupes["near"]:
+                    from core.cleaner_logic import phash_distance, NEAR_DUPLICATE_DISTANCE
                     self.cleaner_results_view.controls.append(ft.Container(ft.Text("Near Duplicates", weight=ft.FontWeight.BOLD), margin=ft.margin.only(top=20)))
                     for group in dupes["near"]:
-                        group_col = ft.Column([create_file_row(file, i > 0) for i, file in enumerate(group)])
+                        # Groups are transitive (A~B~C), so only files close to the kept one are pre-selected
+                        group_col = ft.Column([create_file_row(file, i > 0 and phash_distance(file['phash'], group[0]['phash']) <= NEAR_DUPLICATE_DISTANCE) for i, file in enumerate(group)])
+                        self.cleaner_results_view.controls.append(ft.Card(content=ft.Container(group_col, padding=10)))
+                if dupes["semantic"]:
+                    self.cleaner_results_view.controls.append(ft.Container(ft.Text("Similar Images (crops, resizes, re-encodes)", weight=ft.FontWeight.BOLD), margin=ft.margin.only(top=20)))
+                    for group in dupes["semantic"]:
+                        group_col = ft.Column([create_file_row(file, False) for file in group])
                         self.cleaner_results_view.controls.append(ft.Card(content=ft.Container(group_col, padding=10)))
-                self.update_status("✅ Duplicate scan complete.")
+                self.status_bar.value = done_message # ui_lock is already held; update_status would deadlock
                 if self.page: self.page.update()
         def final_scanner_thread_target():
-            duplicate_data = find_duplicates(self.update_status)
+            from core.cleaner_logic import find_duplicates
+            duplicate_data = find_duplicates(self.update_status, full=full)
             on_scan_complete(duplicate_data)
         threading.Thread(target=final_scanner_thread_target).start()
 
@@ -426,6 +536,16 @@ def main(page: ft.Page):
                         icon="devices_other",
                         on_click=app.show_import_all_dialog
                     ),
+                    ft.PopupMenuItem(
+                        text="Rescan Imported Folders Fully",
+                        icon="refresh",
+                        on_click=app.rescan_imported_folders
+                    ),
+                    ft.PopupMenuItem(
+                        text="Watch Imported Folders",
+                        checked=False,
+                        on_click=app.toggle_watch_mode
+                    ),
                 ]
             )
         ]
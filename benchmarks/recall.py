@@ -0,0 +1,72 @@
+"""
+Recall benchmark: how many of the exact top-10 CLIP matches the IVF index finds.
+
+Builds synthetic 512-d embeddings grouped around random topics (like screenshots
+of the same few apps and sites), trains the IVF lists the way the index store
+does, and compares IVFIndex.search against brute-force search for queries near
+the library's vectors, at several nprobe settings.
+
+    python benchmarks/recall.py [--records 100000] [--queries 200] [--spread 2.0] [--nprobe 8 32 64 128]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+from core.index_store import CLIP_DIM
+from core.vector_index import IVFIndex, normalize_rows, choose_list_count, train_centroids, assign_lists
+
+TOP_K = 10
+RECORDS_PER_TOPIC = 50 # Average synthetic records around one topic
+
+def synthetic_vectors(num_vectors, spread, rng):
+    """Unit vectors around random topics, all sharing a common direction as CLIP embeddings do."""
+    shared = normalize_rows(rng.standard_normal((1, CLIP_DIM)))
+    topics = normalize_rows(rng.standard_normal((max(1, num_vectors // RECORDS_PER_TOPIC), CLIP_DIM)))
+    noise = rng.standard_normal((num_vectors, CLIP_DIM)).astype(np.float32) * (spread / np.sqrt(CLIP_DIM))
+    return normalize_rows(shared + topics[rng.integers(0, len(topics), num_vectors)] + noise)
+
+def exact_top_k(vectors, query, k):
+    scores = vectors @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=100_000, help="size of the synthetic library")
+    parser.add_argument("--queries", type=int, default=200, help="queries to average over")
+    parser.add_argument("--spread", type=float, default=2.0, help="noise around each topic; higher is harder for IVF")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 32, 64, 128], help="IVF lists scored per query")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = synthetic_vectors(args.records, args.spread, rng)
+    start = time.perf_counter()
+    centroids = train_centroids(vectors, choose_list_count(len(vectors)))
+    list_ids = assign_lists(centroids, vectors)
+    print(f"Trained {len(centroids)} lists over {len(vectors)} vectors in {time.perf_counter() - start:.2f}s")
+
+    # Queries land near library vectors, as a typed description of a screenshot would
+    picked = rng.choice(len(vectors), args.queries, replace=False)
+    queries = normalize_rows(vectors[picked] + rng.standard_normal((args.queries, CLIP_DIM)).astype(np.float32) * 0.03)
+
+    start = time.perf_counter()
+    expected = [set(exact_top_k(vectors, query, TOP_K).tolist()) for query in queries]
+    exact_ms = 1000 * (time.perf_counter() - start) / args.queries
+    print(f"{'exact':20}{'recall@10 1.000':>18}{exact_ms:>10.2f} ms/query")
+
+    default_nprobe = IVFIndex(centroids, vectors, list_ids).nprobe
+    for nprobe in sorted(set(args.nprobe) | {default_nprobe}):
+        index = IVFIndex(centroids, vectors, list_ids, nprobe=nprobe)
+        start = time.perf_counter()
+        found = [set(index.search(query, TOP_K)[1].tolist()) for query in queries]
+        ivf_ms = 1000 * (time.perf_counter() - start) / args.queries
+        recall = np.mean([len(hits & truth) / TOP_K for hits, truth in zip(found, expected)])
+        label = f"nprobe {nprobe}" + (" (default)" if nprobe == default_nprobe else "")
+        print(f"{label:20}{'recall@10 ' + format(recall, '.3f'):>18}{ivf_ms:>10.2f} ms/query")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Re-index benchmark: how long replacing and removing changed files takes in a large library.
+
+Builds a synthetic store (random 512-d CLIP vectors, a face on every tenth record)
+in a temporary directory, then times re-indexing a batch of changed files
+(add_records on existing paths) and removing a batch of deleted files (remove_paths).
+
+    python benchmarks/reindex.py [--records 200000] [--changed 10000]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+from core.index_store import IndexStore, CLIP_DIM, FACE_DIM
+
+BUILD_BATCH_SIZE = 10_000 # Records per add_records call while building the library
+
+def synthetic_records(paths, rng):
+    records = []
+    for i, path in enumerate(paths):
+        has_face = i % 10 == 0
+        records.append({
+            "file_path": path, "text": f"screenshot {i} receipt invoice", "width": 1920, "height": 1080,
+            "mod_time": time.time(), "file_size": 100_000 + i,
+            "clip_embedding": rng.standard_normal(CLIP_DIM).astype(np.float32),
+            "face_embeddings": [rng.standard_normal(FACE_DIM).astype(np.float32)] if has_face else [],
+            "face_locations": [(10, 60, 60, 10)] if has_face else [],
+        })
+    return records
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=200_000, help="size of the synthetic library")
+    parser.add_argument("--changed", type=int, default=10_000, help="files changed (and, separately, deleted)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    work_dir = tempfile.mkdtemp(prefix="screenscorch-bench-")
+    try:
+        store = IndexStore(os.path.join(work_dir, "index.db"), os.path.join(work_dir, "clip.f32"),
+                           os.path.join(work_dir, "face.f32"))
+        paths = [f"/library/{i // 1000:04d}/IMG_{i:07d}.png" for i in range(args.records)]
+        build_seconds = 0.0
+        for start in range(0, len(paths), BUILD_BATCH_SIZE):
+            build_seconds += timed(store.add_records, synthetic_records(paths[start:start + BUILD_BATCH_SIZE], rng))
+        print(f"Built a {store.count()}-record library in {build_seconds:.2f}s")
+
+        picked = rng.choice(len(paths), 2 * args.changed, replace=False)
+        changed = [paths[i] for i in picked[:args.changed]]
+        deleted = [paths[i] for i in picked[args.changed:]]
+
+        changed_records = synthetic_records(changed, rng)
+        reindex_seconds = timed(store.add_records, changed_records)
+        remove_seconds = timed(store.remove_paths, deleted)
+        assert store.count() == args.records - args.changed
+
+        print(f"{'re-index ' + str(args.changed) + ' changed':28}{reindex_seconds:>8.2f}s")
+        print(f"{'remove ' + str(args.changed) + ' deleted':28}{remove_seconds:>8.2f}s")
+        store.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Startup benchmark: how long until the window can open, and until search is ready.
+
+Each launch runs in a fresh interpreter. The first launch is reported as "cold"
+(bytecode and OS file caches may still be empty), the median of the rest as "warm".
+
+    python benchmarks/startup.py [--runs 5]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside each fresh interpreter and prints its timings as JSON
+LAUNCH_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import app # Everything the window waits for
+window_ready = time.perf_counter() - start
+from core.index_store import get_store
+has_index = get_store().count() > 0 # What check_initial_state does
+index_checked = time.perf_counter() - start
+search_ready = None
+if has_index:
+    from core.search_logic import load_index_and_model_if_needed # What the background warm-up does
+    load_index_and_model_if_needed()
+    search_ready = time.perf_counter() - start
+print(json.dumps({"window_ready": window_ready, "index_checked": index_checked, "search_ready": search_ready}))
+"""
+
+def launch():
+    output = subprocess.run([sys.executable, "-c", LAUNCH_SCRIPT], cwd=REPO_DIR,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="launches to time (the first is the cold one)")
+    args = parser.parse_args()
+
+    results = [launch() for _ in range(max(2, args.runs))]
+    print(f"{'':16}{'cold':>10}{'warm':>10}")
+    for key in ("window_ready", "index_checked", "search_ready"):
+        if results[0][key] is None:
+            print(f"{key:16}{'(empty index)':>20}")
+            continue
+        warm = statistics.median(result[key] for result in results[1:])
+        print(f"{key:16}{results[0][key]:>9.2f}s{warm:>9.2f}s")
+
+if __name__ == "__main__":
+    main()
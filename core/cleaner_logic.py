@@ -1,71 +1,542 @@
 import os
-import json
 import hashlib
+import threading
+from itertools import combinations
+import numpy as np
 from PIL import Image
 import imagehash
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from .index_store import get_store, IVF_MIN_RECORDS
+from .vector_index import normalize_rows, assign_lists
 
-APP_DIR = os.path.join(os.path.expanduser("~"), ".screenscorch")
-MASTER_INDEX_FILE = os.path.join(APP_DIR, "master_index.json")
+# --- CONFIGURATION ---
+PARTIAL_HASH_BYTES = 64 * 1024 # Read from each end of a file before committing to a full read
+HASH_BUFFER_BYTES = 1024 * 1024
+HASH_WORKERS = min(32, (os.cpu_count() or 4) * 2) # Hashing is I/O bound and hashlib releases the GIL
+NEAR_DUPLICATE_DISTANCE = 10 # Max pHash Hamming distance (of 64 bits) for a near-duplicate
+PHASH_BLOCKS = 4 # Multi-index hashing: the 64-bit hash is looked up as four 16-bit blocks
+PAIR_CANDIDATE_CHUNK = 4_000_000 # Candidate pairs expanded at a time, so crowded buckets can't exhaust memory
+SEMANTIC_DUPLICATE_SIMILARITY = 0.95 # Min CLIP cosine similarity for a semantic near-duplicate
+SEMANTIC_TILE_SIZE = 2048 # Rows per side of each similarity tile, so memory stays at tile x tile scores
+SEMANTIC_PROBE_LISTS = 8 # IVF lists (its own included) each list is joined against
+NORMALIZE_CHUNK_SIZE = 16_384 # CLIP rows read from the memory map and normalized at a time
+DUPLICATE_DELTA_FRACTION = 0.2 # Above this share of changed records, rescanning everything is cheaper
+NEIGHBOUR_CHUNK_SIZE = 64 # Changed hashes compared against the whole library at a time
 
-def find_duplicates(status_callback=None):
+# --- GLOBAL STATE ---
+duplicate_groups_lock = threading.Lock()
+
+def new_hasher():
+    return hashlib.blake2b(digest_size=16)
+
+def partial_file_hash(path, file_size):
+    """Hashes the first and last PARTIAL_HASH_BYTES; for small files that is the whole file."""
+    hasher = new_hasher()
+    with open(path, 'rb') as f:
+        if file_size <= 2 * PARTIAL_HASH_BYTES:
+            hasher.update(f.read())
+        else:
+            hasher.update(f.read(PARTIAL_HASH_BYTES))
+            f.seek(-PARTIAL_HASH_BYTES, os.SEEK_END)
+            hasher.update(f.read(PARTIAL_HASH_BYTES))
+    return hasher.hexdigest()
+
+def full_file_hash(path):
+    hasher = new_hasher()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_BUFFER_BYTES):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def current_stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+def hash_in_parallel(pool, function, paths, *args):
+    """Returns {path: hash} for the paths that could be read."""
+    def safe_hash(path):
+        try:
+            return function(path, *args) if args else function(path)
+        except OSError:
+            return None
+    return {path: digest for path, digest in zip(paths, pool.map(safe_hash, paths)) if digest is not None}
+
+def find_exact_duplicates(store, records, status_callback=None):
     """
-    Finds exact and near-duplicate images from the MASTER index.
+    Groups byte-identical files in stages, so most files are never read:
+    1. by file size (from stat); a file with a unique size has no duplicate,
+    2. by a hash of the first and last 64 KB,
+    3. by a full BLAKE2 hash, only for files that still collide.
+    Hashes are saved in `store` with the mtime and size they were computed
+    for and reused while those still match. Reads run on a thread pool.
     """
-    try:
-        with open(MASTER_INDEX_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        path_to_object_map = {item['file_path']: item for item in data}
-        
-    except FileNotFoundError:
-        if status_callback: status_callback("❌ Master index not found. Please run the indexer first.")
+    records_by_path = {item['file_path']: item for item in records}
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        stats = dict(zip(records_by_path, pool.map(current_stat, records_by_path)))
+
+        # Hashes from an earlier scan, if the file hasn't changed since
+        partial_hashes, content_hashes = {}, {}
+        for path, stat in stats.items():
+            item = records_by_path[path]
+            if stat is not None and stat == (item['hash_mod_time'], item['hash_file_size']):
+                if item['partial_hash']: partial_hashes[path] = item['partial_hash']
+                if item['content_hash']: content_hashes[path] = item['content_hash']
+
+        # --- 1. Group by Size ---
+        by_size = defaultdict(list)
+        for path, stat in stats.items():
+            if stat is not None: by_size[stat[1]].append(path)
+        candidates = [path for group in by_size.values() if len(group) > 1 for path in group]
+
+        # --- 2. Group by Head/Tail Hash ---
+        to_read = [path for path in candidates if path not in partial_hashes]
+        if status_callback: status_callback(f"Comparing {len(candidates)} same-size files ({len(to_read)} to read)...")
+        new_partial = hash_in_parallel(pool, lambda path: partial_file_hash(path, stats[path][1]), to_read)
+        partial_hashes.update(new_partial)
+        by_partial = defaultdict(list)
+        for path in candidates:
+            if path in partial_hashes: by_partial[(stats[path][1], partial_hashes[path])].append(path)
+        for (size, partial_hash), group in by_partial.items():
+            if size <= 2 * PARTIAL_HASH_BYTES: # The partial hash already covered the whole file
+                for path in group: content_hashes.setdefault(path, partial_hash)
+        candidates = [path for group in by_partial.values() if len(group) > 1 for path in group]
+
+        # --- 3. Group by Full Hash ---
+        to_read = [path for path in candidates if path not in content_hashes]
+        if status_callback: status_callback(f"Fully hashing {len(to_read)} possible duplicates...")
+        new_content = hash_in_parallel(pool, full_file_hash, to_read)
+        content_hashes.update(new_content)
+
+    updated = set(new_partial) | set(new_content)
+    if updated:
+        store.save_content_hashes([
+            (path, *stats[path], partial_hashes.get(path), content_hashes.get(path)) for path in updated
+        ])
+
+    exact_hashes = defaultdict(list)
+    for path in candidates:
+        if path in content_hashes: exact_hashes[(stats[path][1], content_hashes[path])].append(path)
+    groups = [sorted(group, key=lambda path: records_by_path[path]['id']) for group in exact_hashes.values() if len(group) > 1]
+    groups.sort(key=lambda group: records_by_path[group[0]]['id']) # Index order, as before
+    return [[records_by_path[path] for path in group] for group in groups]
+
+# --- Near Duplicates (Perceptual Hashes) ---
+def perceptual_hash(image):
+    """
+    The image's 64-bit pHash as a signed integer (SQLite's INTEGER is signed).
+    Computed once per file at index time.
+    """
+    value = int(str(imagehash.phash(image)), 16)
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def file_perceptual_hash(path):
+    with Image.open(path) as img:
+        img.draft('RGB', (256, 256)) # Let JPEG decode at a reduced size
+        return perceptual_hash(img)
+
+def phash_distance(first, second):
+    """Hamming distance between two stored (signed 64-bit) pHashes."""
+    return ((first ^ second) & ((1 << 64) - 1)).bit_count()
+
+def popcount(values):
+    if hasattr(np, 'bitwise_count'): # NumPy 2.0+
+        return np.bitwise_count(values)
+    bytes_view = values.view(np.uint8).reshape(-1, 8)
+    return np.unpackbits(bytes_view, axis=1).sum(axis=1)
+
+def near_duplicate_pairs(hashes, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """
+    Returns (left, right) index arrays of every pair of hashes within `max_distance`,
+    using multi-index hashing: by the pigeonhole principle two hashes that differ in
+    at most `max_distance` bits differ in at most max_distance // PHASH_BLOCKS bits in
+    at least one block. Each block is bucketed, every hash probes the buckets within
+    that radius of its own block, and the candidates are checked with a vectorized popcount.
+    """
+    hashes = np.asarray(hashes, dtype=np.int64).view(np.uint64)
+    num_hashes = len(hashes)
+    block_bits = 64 // PHASH_BLOCKS
+    radius = max_distance // PHASH_BLOCKS
+    flips = np.array([sum(1 << bit for bit in bits) for r in range(radius + 1)
+                      for bits in combinations(range(block_bits), r)], dtype=np.uint64)
+    all_positions = np.arange(num_hashes)
+    lefts, rights = [], []
+    for block in range(PHASH_BLOCKS):
+        keys = ((hashes >> np.uint64(block * block_bits)) & np.uint64((1 << block_bits) - 1)).astype(np.int64)
+        order = np.argsort(keys, kind='stable')
+        bucket_sizes = np.bincount(keys, minlength=1 << block_bits)
+        bucket_starts = np.cumsum(bucket_sizes) - bucket_sizes
+        for flip in flips.astype(np.int64):
+            probes = keys ^ flip
+            # Each unordered pair once per block: a flip links two different buckets, so only
+            # probe upwards; within one bucket (flip 0) keep left < right below.
+            sources = all_positions if flip == 0 else np.flatnonzero(probes > keys)
+            counts = bucket_sizes[probes[sources]]
+            ends = np.cumsum(counts)
+            if len(ends) == 0 or ends[-1] == 0:
+                continue
+            cuts = np.searchsorted(ends, np.arange(PAIR_CANDIDATE_CHUNK, ends[-1], PAIR_CANDIDATE_CHUNK), side='right')
+            bounds = [0, *np.unique(cuts).tolist(), len(sources)]
+            for low, high in zip(bounds, bounds[1:]):
+                piece, piece_counts = sources[low:high], counts[low:high]
+                total = int(piece_counts.sum())
+                if total == 0:
+                    continue
+                piece_ends = np.cumsum(piece_counts)
+                left = np.repeat(piece, piece_counts)
+                right = order[np.repeat(bucket_starts[probes[piece]] - (piece_ends - piece_counts), piece_counts)
+                              + np.arange(total)]
+                if flip == 0:
+                    keep = left < right
+                    left, right = left[keep], right[keep]
+                close = popcount(hashes[left] ^ hashes[right]) <= max_distance
+                lefts.append(left[close])
+                rights.append(right[close])
+    if not lefts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(lefts), np.concatenate(rights)
+
+def union_find_groups(num_items, lefts, rights):
+    """Connected components of the pair graph; the result doesn't depend on pair order."""
+    parent = list(range(num_items))
+    def find(item):
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+    for left, right in zip(lefts.tolist(), rights.tolist()):
+        left_root, right_root = find(left), find(right)
+        if left_root != right_root:
+            parent[max(left_root, right_root)] = min(left_root, right_root)
+    groups = defaultdict(list)
+    for item in range(num_items):
+        groups[find(item)].append(item)
+    return [group for group in groups.values() if len(group) > 1]
+
+def fill_missing_phashes(store, records, status_callback=None):
+    """
+    Returns the records that have a pHash. Records indexed before hashes were stored
+    get theirs computed once here (filled in place) and saved to `store`.
+    """
+    missing = [item for item in records if item['phash'] is None]
+    if missing:
+        if status_callback: status_callback(f"Computing perceptual hashes for {len(missing)} older records...")
+        def safe_hash(path):
+            try:
+                return file_perceptual_hash(path)
+            except Exception:
+                return None # Skip corrupted or missing images
+        paths = [item['file_path'] for item in missing]
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            computed = {path: phash for path, phash in zip(paths, pool.map(safe_hash, paths)) if phash is not None}
+        store.save_phashes(computed.items())
+        for item in missing:
+            item['phash'] = computed.get(item['file_path'])
+    return [item for item in records if item['phash'] is not None]
+
+def near_duplicate_components(hashed):
+    """
+    Groups records whose pHashes are within NEAR_DUPLICATE_DISTANCE (transitively).
+    Identical hashes are collapsed before the pair search, so large sets of
+    identical images cost nothing extra.
+    """
+    if len(hashed) < 2:
+        return []
+    hashes = np.array([item['phash'] for item in hashed], dtype=np.int64)
+    unique_hashes, owners = np.unique(hashes, return_inverse=True)
+    lefts, rights = near_duplicate_pairs(unique_hashes)
+    # Join every record to its distinct hash's node, then link nodes that are close
+    num_unique = len(unique_hashes)
+    record_nodes = np.arange(len(hashed)) + num_unique
+    groups = union_find_groups(num_unique + len(hashed),
+                               np.concatenate([lefts, owners]), np.concatenate([rights, record_nodes]))
+    components = [[hashed[node - num_unique] for node in group if node >= num_unique] for group in groups]
+    return [members for members in components if len(members) > 1]
+
+def hash_neighbour_ids(hashed, query_hashes, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """Ids of the records whose pHash is within `max_distance` of any of `query_hashes`."""
+    hashes = np.array([item['phash'] for item in hashed], dtype=np.int64).view(np.uint64)
+    queries = np.asarray(query_hashes, dtype=np.int64).view(np.uint64)
+    close = np.zeros(len(hashes), dtype=bool)
+    for start in range(0, len(queries), NEIGHBOUR_CHUNK_SIZE):
+        chunk = queries[start:start + NEIGHBOUR_CHUNK_SIZE]
+        close |= (popcount(hashes[None, :] ^ chunk[:, None]) <= max_distance).any(axis=0)
+    return {hashed[position]['id'] for position in np.flatnonzero(close)}
+
+# --- Semantic Near Duplicates (CLIP) ---
+def tile_similarity_pairs(vectors, left_positions, right_positions, threshold, same=False):
+    """
+    Pairs (left, right) with cosine similarity >= threshold between two sets of
+    normalized rows, scored one SEMANTIC_TILE_SIZE x SEMANTIC_TILE_SIZE tile at a time.
+    With `same`, both sides are the same set and each pair is returned once.
+    """
+    lefts, rights = [], []
+    for left_start in range(0, len(left_positions), SEMANTIC_TILE_SIZE):
+        left_tile = left_positions[left_start:left_start + SEMANTIC_TILE_SIZE]
+        left_vectors = vectors[left_tile]
+        for right_start in range(left_start if same else 0, len(right_positions), SEMANTIC_TILE_SIZE):
+            right_tile = right_positions[right_start:right_start + SEMANTIC_TILE_SIZE]
+            scores = left_vectors @ vectors[right_tile].T
+            if same and right_start == left_start:
+                scores = np.triu(scores, 1) # Skip self-pairs and the mirrored half
+            left, right = np.nonzero(scores >= threshold)
+            lefts.append(left_tile[left])
+            rights.append(right_tile[right])
+    if not lefts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(lefts), np.concatenate(rights)
+
+def adjacent_lists(centroids):
+    """
+    Which IVF lists the semantic join pairs up: each list with its SEMANTIC_PROBE_LISTS - 1
+    nearest, in both directions (two lists are joined if either is among the other's nearest).
+    """
+    num_probes = min(SEMANTIC_PROBE_LISTS, len(centroids))
+    neighbours = np.argsort(-(centroids @ centroids.T), axis=1)[:, :num_probes]
+    adjacent = np.zeros((len(centroids), len(centroids)), dtype=bool)
+    adjacent[np.arange(len(centroids))[:, None], neighbours] = True
+    return adjacent | adjacent.T
+
+def semantic_duplicate_pairs(vectors, threshold=SEMANTIC_DUPLICATE_SIMILARITY, centroids=None, list_ids=None):
+    """
+    Returns (left, right) positions of every pair of normalized vectors with cosine
+    similarity >= threshold. Without IVF centroids this is an exact blocked join.
+    With them, each list is only joined with itself and its SEMANTIC_PROBE_LISTS - 1
+    nearest lists: near-duplicates sit almost on top of each other, so they share a
+    list or fall into neighbouring ones, and the join costs ~N x (list size x probes).
+    """
+    if centroids is None:
+        positions = np.arange(len(vectors))
+        return tile_similarity_pairs(vectors, positions, positions, threshold, same=True)
+
+    list_ids = np.asarray(list_ids, dtype=np.int64)
+    order = np.argsort(list_ids, kind='stable')
+    offsets = np.searchsorted(list_ids[order], np.arange(len(centroids) + 1))
+    adjacent = adjacent_lists(centroids)
+    lefts, rights = [], []
+    for list_id in range(len(centroids)):
+        members = order[offsets[list_id]:offsets[list_id + 1]]
+        if len(members) == 0:
+            continue
+        others = (np.flatnonzero(adjacent[list_id, list_id + 1:]) + list_id + 1).tolist() # Each pair of lists once
+        left, right = tile_similarity_pairs(vectors, members, members, threshold, same=True)
+        lefts.append(left)
+        rights.append(right)
+        if others:
+            candidates = np.concatenate([order[offsets[other]:offsets[other + 1]] for other in others])
+            left, right = tile_similarity_pairs(vectors, members, candidates, threshold)
+            lefts.append(left)
+            rights.append(right)
+    if not lefts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(lefts), np.concatenate(rights)
+
+def normalized_clip_rows(store, clip_rows):
+    """Normalized CLIP vectors for the given rows, read from the memory map in chunks."""
+    clip_rows = np.asarray(clip_rows, dtype=np.int64)
+    matrix = store.clip_matrix()
+    vectors = np.empty((len(clip_rows), store.clip_vectors.dim), dtype=np.float32)
+    for start in range(0, len(clip_rows), NORMALIZE_CHUNK_SIZE):
+        vectors[start:start + NORMALIZE_CHUNK_SIZE] = normalize_rows(matrix[clip_rows[start:start + NORMALIZE_CHUNK_SIZE]])
+    return vectors
+
+def ivf_lists_for(store, embedded):
+    """Each record's IVF list; rows added since training are assigned here."""
+    list_ids = np.array([item['ivf_list'] if item['ivf_list'] is not None else -1 for item in embedded], dtype=np.int64)
+    unassigned = np.flatnonzero(list_ids < 0)
+    if len(unassigned):
+        list_ids[unassigned] = assign_lists(store.clip_centroids,
+                                            normalized_clip_rows(store, [embedded[p]['clip_row'] for p in unassigned]))
+    return list_ids
+
+def ensure_clip_index(store, status_callback=None):
+    """
+    Trains the IVF lists for a large library that has none yet (a migrated JSON index,
+    or one only ever updated by watch mode); without them the semantic join is exact, O(N^2).
+    """
+    if store.clip_centroids is None and store.count() >= IVF_MIN_RECORDS:
+        if status_callback: status_callback("🧭 Building the visual search index...")
+        store.train_clip_index()
+
+def semantic_duplicate_components(store, embedded, threshold):
+    """
+    Groups records whose CLIP embeddings are nearly identical (cosine >= threshold),
+    which catches crops, re-encodes and resized copies that pHash misses.
+    Uses the index's IVF lists when it has them.
+    """
+    if len(embedded) < 2:
+        return []
+    vectors = normalized_clip_rows(store, [item['clip_row'] for item in embedded])
+    centroids = store.clip_centroids
+    list_ids = ivf_lists_for(store, embedded) if centroids is not None else None
+    lefts, rights = semantic_duplicate_pairs(vectors, threshold, centroids, list_ids)
+    return [[embedded[position] for position in group] for group in union_find_groups(len(embedded), lefts, rights)]
+
+def semantic_neighbour_ids(store, embedded, changed_ids, threshold):
+    """
+    Ids of the records within `threshold` of a changed record. With IVF lists, only the
+    lists the semantic join would pair the changed record's list with are compared,
+    so the result agrees with a full scan. Only the compared rows are normalized.
+    """
+    changed_positions = np.array([p for p, item in enumerate(embedded) if item['id'] in changed_ids], dtype=np.int64)
+    if len(changed_positions) == 0:
+        return set()
+    clip_rows = np.array([item['clip_row'] for item in embedded], dtype=np.int64)
+    queries = normalized_clip_rows(store, clip_rows[changed_positions])
+
+    centroids = store.clip_centroids
+    if centroids is None:
+        searches = [(np.arange(len(queries)), np.arange(len(embedded)))]
+    else:
+        list_ids = ivf_lists_for(store, embedded)
+        order = np.argsort(list_ids, kind='stable')
+        offsets = np.searchsorted(list_ids[order], np.arange(len(centroids) + 1))
+        adjacent = adjacent_lists(centroids)
+        query_lists = list_ids[changed_positions]
+        searches = []
+        for list_id in np.unique(query_lists).tolist():
+            candidates = np.concatenate([order[offsets[other]:offsets[other + 1]]
+                                         for other in np.flatnonzero(adjacent[list_id]).tolist()])
+            searches.append((np.flatnonzero(query_lists == list_id), candidates))
+
+    # Each candidate row is read and normalized once, however many changed records compare against it
+    compared = np.unique(np.concatenate([candidates for _, candidates in searches]))
+    compared_vectors = None if centroids is None else normalized_clip_rows(store, clip_rows[compared])
+    matches = set()
+    for query_positions, candidates in searches:
+        for start in range(0, len(candidates), SEMANTIC_TILE_SIZE):
+            tile = candidates[start:start + SEMANTIC_TILE_SIZE]
+            if compared_vectors is None:
+                tile_vectors = normalized_clip_rows(store, clip_rows[tile])
+            else:
+                tile_vectors = compared_vectors[np.searchsorted(compared, tile)]
+            for query_start in range(0, len(query_positions), SEMANTIC_TILE_SIZE):
+                scores = queries[query_positions[query_start:query_start + SEMANTIC_TILE_SIZE]] @ tile_vectors.T
+                matches.update(embedded[p]['id'] for p in tile[(scores >= threshold).any(axis=0)].tolist())
+    return matches
+
+# --- Saved Duplicate Groups ---
+def group_ids(groups):
+    return [[item['id'] for item in group] for group in groups]
+
+def with_group_mates(saved_groups, record_ids):
+    """`record_ids` plus every other member of the saved groups (of one kind) they belong to."""
+    group_of = {record_id: group_id for group_id, members in saved_groups.items() for record_id in members}
+    affected = set(record_ids)
+    for record_id in record_ids:
+        if record_id in group_of: affected.update(saved_groups[group_of[record_id]])
+    return affected
+
+def update_duplicate_groups(store, full=False, semantic_threshold=SEMANTIC_DUPLICATE_SIMILARITY, status_callback=None):
+    """
+    Keeps the saved duplicate groups up to date with the index. The first run (or
+    `full=True`, a new threshold, or a gap in the change log) scans everything; after
+    that only records added, changed or removed since the last run are looked at,
+    together with their saved groups and, for the similarity modes, the records they
+    now match. Everything outside those groups is untouched, so the result is the same
+    as a full scan. Returns how many records were rescanned.
+    """
+    with duplicate_groups_lock:
+        if semantic_threshold is not None:
+            ensure_clip_index(store, status_callback) # Before reading the generation: training restarts the change log
+        saved_generation, saved_threshold = store.duplicate_groups_state()
+        generation, changed_ids = store.changes_since(saved_generation)
+        if saved_threshold != semantic_threshold:
+            changed_ids = None
+        if not full and changed_ids == []:
+            return 0
+        records = store.load_records(include_embeddings=False)
+
+        if full or changed_ids is None or len(changed_ids) > DUPLICATE_DELTA_FRACTION * len(records):
+            if status_callback: status_callback("Scanning for exact duplicates...")
+            groups = {"exact": group_ids(find_exact_duplicates(store, records, status_callback))}
+            if status_callback: status_callback("Scanning for near-duplicates...")
+            groups["near"] = group_ids(near_duplicate_components(fill_missing_phashes(store, records, status_callback)))
+            groups["semantic"] = []
+            if semantic_threshold is not None:
+                if status_callback: status_callback("Scanning for semantically similar images...")
+                embedded = [item for item in records if item['clip_row'] is not None]
+                groups["semantic"] = group_ids(semantic_duplicate_components(store, embedded, semantic_threshold))
+            store.save_duplicate_groups(groups, {}, generation, semantic_threshold, reset=True)
+            return len(records)
+
+        if status_callback: status_callback(f"Updating duplicate groups for {len(changed_ids)} changed files...")
+        saved = store.load_duplicate_groups()
+        changed = set(changed_ids)
+        by_id = {item['id']: item for item in records}
+        groups, cleared = {}, {}
+
+        # --- 1. Exact: every record sharing a size with a changed record or its old group ---
+        affected = with_group_mates(saved.get("exact", {}), changed)
+        sizes = {by_id[record_id]['file_size'] for record_id in affected if record_id in by_id}
+        same_size = [item for item in records if item['file_size'] in sizes]
+        cleared["exact"] = affected | {item['id'] for item in same_size}
+        groups["exact"] = group_ids(find_exact_duplicates(store, same_size))
+
+        # --- 2. Near: changed records, what their hashes now match, and those records' groups ---
+        hashed = fill_missing_phashes(store, records, status_callback)
+        changed_hashes = [by_id[record_id]['phash'] for record_id in changed
+                          if record_id in by_id and by_id[record_id]['phash'] is not None]
+        affected = with_group_mates(saved.get("near", {}), changed | hash_neighbour_ids(hashed, changed_hashes))
+        cleared["near"] = affected
+        groups["near"] = group_ids(near_duplicate_components([item for item in hashed if item['id'] in affected]))
+
+        # --- 3. Semantic: the same, with CLIP neighbours ---
+        if semantic_threshold is not None:
+            embedded = [item for item in records if item['clip_row'] is not None]
+            matches = semantic_neighbour_ids(store, embedded, changed, semantic_threshold)
+            affected = with_group_mates(saved.get("semantic", {}), changed | matches)
+            cleared["semantic"] = affected
+            groups["semantic"] = group_ids(semantic_duplicate_components(
+                store, [item for item in embedded if item['id'] in affected], semantic_threshold))
+
+        store.save_duplicate_groups(groups, cleared, generation, semantic_threshold)
+        return len(changed_ids)
+
+def load_duplicate_groups(store):
+    """
+    The saved groups as {"exact", "near", "semantic"} lists of records, each group in
+    index order. Files that no longer exist are left out, and similar-image groups
+    that the exact or near sections already show in full aren't listed again.
+    """
+    saved = store.load_duplicate_groups()
+    record_ids = [record_id for kind_groups in saved.values() for members in kind_groups.values() for record_id in members]
+    by_id = {item['id']: item for item in store.load_records(include_embeddings=False, record_ids=record_ids)}
+    exists = {}
+    result = {}
+    for kind in ("exact", "near", "semantic"):
+        result[kind] = []
+        for _, members in sorted(saved.get(kind, {}).items()):
+            members = [by_id[record_id] for record_id in members if record_id in by_id]
+            for item in members:
+                if item['id'] not in exists: exists[item['id']] = os.path.exists(item['file_path'])
+            members = [item for item in members if exists[item['id']]]
+            if len(members) > 1: result[kind].append(members)
+
+    shown_in = {item['id']: number for number, group in enumerate(result["exact"] + result["near"]) for item in group}
+    result["semantic"] = [group for group in result["semantic"]
+                          if len({shown_in.get(item['id'], -1 - item['id']) for item in group}) > 1]
+    return result
+
+def find_duplicates(status_callback=None, semantic_threshold=SEMANTIC_DUPLICATE_SIMILARITY, full=False):
+    """
+    Finds exact, near (pHash) and semantic (CLIP) duplicate images from the MASTER index.
+    Groups are saved and only patched for files that changed since the last scan;
+    `full=True` rescans everything. Pass semantic_threshold=None to skip the CLIP mode.
+    """
+    store = get_store()
+    if store.count() == 0:
+        if status_callback: status_callback("❌ Master index is empty. Please run the indexer first.")
         return None
-    except json.JSONDecodeError:
-        if status_callback: status_callback("❌ Error reading master index. It might be corrupted.")
+    try:
+        update_duplicate_groups(store, full, semantic_threshold, status_callback)
+        duplicates = load_duplicate_groups(store)
+    except Exception as e:
+        if status_callback: status_callback(f"❌ Error reading master index: {e}")
         return None
 
-    if status_callback: status_callback("Scanning for exact duplicates...")
-    exact_hashes = defaultdict(list)
-    for path in path_to_object_map.keys():
-        if not os.path.exists(path): continue
-        hasher = hashlib.md5()
-        with open(path, 'rb') as f:
-            while chunk := f.read(8192):
-                hasher.update(chunk)
-        file_hash = hasher.hexdigest()
-        exact_hashes[file_hash].append(path)
-    
-    exact_dupes_groups = [
-        [path_to_object_map[path] for path in group] 
-        for group in exact_hashes.values() if len(group) > 1
-    ]
-
-    if status_callback: status_callback("Scanning for near-duplicates (this may take time)...")
-    near_hashes = {}
-    for path in path_to_object_map.keys():
-        if not os.path.exists(path): continue
-        try:
-            with Image.open(path) as img:
-                p_hash = imagehash.phash(img)
-                near_hashes[path] = p_hash
-        except Exception:
-            continue # Skip corrupted images
-
-    near_dupes_groups = []
-    matched_files = set()
-    for path1, hash1 in near_hashes.items():
-        if path1 in matched_files: continue
-        current_group_paths = [path1]
-        for path2, hash2 in near_hashes.items():
-            if path1 == path2 or path2 in matched_files: continue
-            if hash1 - hash2 <= 10: # Similarity threshold
-                current_group_paths.append(path2)
-        
-        if len(current_group_paths) > 1:
-            near_dupes_groups.append([path_to_object_map[path] for path in current_group_paths])
-            for path in current_group_paths:
-                matched_files.add(path)
-    
     if status_callback: status_callback("✅ Duplicate scan complete.")
-    return {"exact": exact_dupes_groups, "near": near_dupes_groups}
\ No newline at end of file
+    return duplicates
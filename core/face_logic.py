@@ -1,33 +1,250 @@
 import os
 import json
+import threading
 import numpy as np
 
 APP_DIR = os.path.join(os.path.expanduser("~"), ".screenscorch")
 KNOWN_FACES_FILE = os.path.join(APP_DIR, "known_faces.json")
 
-def load_known_faces():
-    """Loads the known faces database from a JSON file."""
+FACE_MATCH_TOLERANCE = 0.6 # face_recognition's recommended distance for "same person"
+MAX_SAMPLES_PER_PERSON = 32 # Oldest samples are dropped beyond this
+
+# --- GLOBAL CACHE ---
+# Loaded once and invalidated whenever save_known_face writes the file
+known_faces_cache = None # {name: (num_samples x 128) array}
+known_matrix_cache = None # Every sample of every person stacked into one matrix...
+known_owner_names_cache = None # ...and the name each row belongs to
+known_faces_version = 0 # Bumped on every save, so callers caching face results can tell they're stale
+known_faces_lock = threading.RLock()
+
+def read_known_faces_file():
+    """Reads known_faces.json as {name: [samples]}. Older files stored one embedding per name."""
     if not os.path.exists(KNOWN_FACES_FILE):
-        return {}, [] # Return empty if file doesn't exist
-    
+        return {}
     with open(KNOWN_FACES_FILE, 'r') as f:
-        known_faces_data = json.load(f)
-    
-    known_face_names = list(known_faces_data.keys())
-    known_face_embeddings = [np.array(enc) for enc in known_faces_data.values()]
-    return known_face_names, known_face_embeddings
-
-def save_known_face(name, embedding):
-    """Adds a new face and name to the database."""
-    if not os.path.exists(KNOWN_FACES_FILE):
-        known_faces_data = {}
-    else:
-        with open(KNOWN_FACES_FILE, 'r') as f:
-            known_faces_data = json.load(f)
-            
-    # For simplicity, we just overwrite if the name exists.
-    # A real app might handle this more gracefully.
-    known_faces_data[name.lower()] = embedding
-    
-    with open(KNOWN_FACES_FILE, 'w') as f:
-        json.dump(known_faces_data, f, indent=4)
\ No newline at end of file
+        data = json.load(f)
+    return {name: [value] if value and not isinstance(value[0], list) else value for name, value in data.items()}
+
+def get_known_faces():
+    """Returns the cached {name: (num_samples x 128) array} of known people."""
+    global known_faces_cache, known_matrix_cache, known_owner_names_cache
+    with known_faces_lock:
+        if known_faces_cache is None:
+            known_faces = {name: np.array(samples, dtype=np.float32).reshape(-1, 128)
+                           for name, samples in read_known_faces_file().items()}
+            known_matrix_cache = (np.concatenate(list(known_faces.values())) if known_faces
+                                  else np.empty((0, 128), dtype=np.float32))
+            known_owner_names_cache = [name for name, samples in known_faces.items() for _ in range(len(samples))]
+            known_faces_cache = known_faces
+        return known_faces_cache
+
+def match_known_faces(embeddings, tolerance=FACE_MATCH_TOLERANCE):
+    """
+    Returns, for each face embedding, the name of the known person with the
+    closest sample within `tolerance`, or None. One vectorized pass over every sample.
+    """
+    with known_faces_lock:
+        get_known_faces()
+        matrix, owner_names = known_matrix_cache, known_owner_names_cache
+    embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, 128)
+    if len(matrix) == 0 or len(embeddings) == 0:
+        return [None] * len(embeddings)
+    positions, distances = nearest_faces(embeddings, matrix)
+    return [owner_names[position] if distance <= tolerance else None
+            for position, distance in zip(positions.tolist(), distances.tolist())]
+
+def save_known_face(name, embeddings):
+    """
+    Adds one embedding (or several) to a person's samples, creating the person
+    if needed, and invalidates the cache. The file is replaced atomically.
+    """
+    global known_faces_cache, known_faces_version
+    embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, 128)
+    with known_faces_lock:
+        known_faces_data = read_known_faces_file()
+        samples = known_faces_data.get(name.lower(), []) + embeddings.tolist()
+        known_faces_data[name.lower()] = samples[-MAX_SAMPLES_PER_PERSON:]
+        os.makedirs(APP_DIR, exist_ok=True)
+        temp_path = KNOWN_FACES_FILE + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(known_faces_data, f)
+        os.replace(temp_path, KNOWN_FACES_FILE)
+        known_faces_cache = None
+        known_faces_version += 1
+
+# --- Face Clustering ---
+FACE_CLUSTER_TOLERANCE = 0.5 # Stricter than search matching (0.6): one bad link merges two people
+CLUSTER_ITERATIONS = 20
+DISTANCE_TILE_SIZE = 2048 # Rows per side of each distance block, so memory stays at tile x tile
+face_cluster_lock = threading.Lock()
+
+def squared_norms(vectors):
+    return np.einsum('ij,ij->i', vectors, vectors)
+
+def face_pairs_within(queries, embeddings, tolerance):
+    """
+    Returns (query_positions, embedding_positions) of every pair closer than `tolerance`,
+    grouped by query. Distances are computed one DISTANCE_TILE_SIZE x DISTANCE_TILE_SIZE
+    block at a time, so memory doesn't grow with the number of faces.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    embedding_norms = squared_norms(embeddings)
+    query_parts, embedding_parts = [], []
+    for query_start in range(0, len(queries), DISTANCE_TILE_SIZE):
+        query_tile = queries[query_start:query_start + DISTANCE_TILE_SIZE]
+        query_norms = squared_norms(query_tile)[:, None]
+        rows_parts, cols_parts = [], []
+        for start in range(0, len(embeddings), DISTANCE_TILE_SIZE):
+            tile = embeddings[start:start + DISTANCE_TILE_SIZE]
+            # |q - e|^2 = |q|^2 + |e|^2 - 2 q.e
+            squared = query_norms + embedding_norms[None, start:start + len(tile)] - 2 * (query_tile @ tile.T)
+            rows, cols = np.nonzero(squared <= tolerance ** 2)
+            rows_parts.append(rows.astype(np.int32))
+            cols_parts.append((cols + start).astype(np.int32))
+        rows, cols = np.concatenate(rows_parts), np.concatenate(cols_parts)
+        order = np.argsort(rows, kind='stable') # Group this tile's pairs by query again
+        query_parts.append(rows[order] + query_start)
+        embedding_parts.append(cols[order])
+    if not query_parts:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    return np.concatenate(query_parts), np.concatenate(embedding_parts)
+
+def nearest_faces(queries, embeddings):
+    """Returns (positions, distances) of the nearest embedding to each query, scanning tile by tile."""
+    queries = np.asarray(queries, dtype=np.float32)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    embedding_norms = squared_norms(embeddings)
+    positions = np.zeros(len(queries), dtype=np.int64)
+    distances = np.full(len(queries), np.inf, dtype=np.float32)
+    for query_start in range(0, len(queries), DISTANCE_TILE_SIZE):
+        query_tile = queries[query_start:query_start + DISTANCE_TILE_SIZE]
+        tile_rows = np.arange(len(query_tile))
+        best = np.full(len(query_tile), np.inf, dtype=np.float32)
+        best_positions = np.zeros(len(query_tile), dtype=np.int64)
+        for start in range(0, len(embeddings), DISTANCE_TILE_SIZE):
+            tile = embeddings[start:start + DISTANCE_TILE_SIZE]
+            squared = embedding_norms[None, start:start + len(tile)] - 2 * (query_tile @ tile.T)
+            nearest = np.argmin(squared, axis=1)
+            candidate = squared[tile_rows, nearest]
+            better = candidate < best
+            best[better] = candidate[better]
+            best_positions[better] = nearest[better] + start
+        positions[query_start:query_start + len(query_tile)] = best_positions
+        if len(embeddings):
+            distances[query_start:query_start + len(query_tile)] = np.sqrt(np.maximum(best + squared_norms(query_tile), 0))
+    return positions, distances
+
+def chinese_whispers(embeddings, tolerance=FACE_CLUSTER_TOLERANCE, iterations=CLUSTER_ITERATIONS, seed=0):
+    """
+    Graph clustering as used by dlib: faces closer than `tolerance` are linked, every
+    face starts in its own cluster, and each in turn adopts the most common cluster
+    among its neighbours until nothing changes. Returns a cluster number per face.
+    """
+    num_faces = len(embeddings)
+    sources, targets = face_pairs_within(embeddings, embeddings, tolerance)
+    keep = sources != targets
+    sources, targets = sources[keep], targets[keep] # Already grouped by source
+    offsets = np.searchsorted(sources, np.arange(num_faces + 1))
+
+    labels = np.arange(num_faces)
+    rng = np.random.default_rng(seed)
+    for _ in range(iterations):
+        changed = False
+        for face in rng.permutation(num_faces):
+            neighbours = targets[offsets[face]:offsets[face + 1]]
+            if len(neighbours) == 0:
+                continue
+            values, counts = np.unique(labels[neighbours], return_counts=True)
+            best = values[np.argmax(counts)]
+            if best != labels[face]:
+                labels[face] = best
+                changed = True
+        if not changed:
+            break
+    return np.unique(labels, return_inverse=True)[1]
+
+def groups_from_labels(face_ids, labels):
+    order = np.argsort(labels, kind='stable')
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    return [group.tolist() for group in np.split(face_ids[order], boundaries)] if len(order) else []
+
+def update_face_clusters(store, full=False, status_callback=None):
+    """
+    Keeps the face clusters up to date. The first run (or `full=True`) clusters every
+    face; after that, new faces join the cluster of their nearest clustered face if it
+    is within FACE_CLUSTER_TOLERANCE, and the rest are clustered among themselves.
+    A full re-cluster keeps each cluster's name when most of its faces stay together.
+    """
+    with face_cluster_lock:
+        faces = store.load_face_table()
+        face_ids, cluster_ids, embeddings = faces["face_ids"], faces["cluster_ids"], faces["embeddings"]
+        clustered = cluster_ids >= 0
+        if not full and clustered.all():
+            store.save_face_clusters() # Just drops clusters whose faces were all deleted
+            return 0
+
+        if full or not clustered.any():
+            if status_callback: status_callback(f"🧑‍🤝‍🧑 Grouping {len(face_ids)} faces...")
+            labels = chinese_whispers(embeddings)
+            groups = groups_from_labels(face_ids, labels)
+            names = store.face_cluster_names()
+            old_cluster_by_face = dict(zip(face_ids.tolist(), cluster_ids.tolist()))
+            group_names = []
+            for group in groups:
+                old_clusters, counts = np.unique([old_cluster_by_face[f] for f in group], return_counts=True)
+                majority = old_clusters[np.argmax(counts)]
+                group_names.append(names.get(int(majority)) if majority >= 0 else None)
+            store.save_face_clusters(new_groups=groups, group_names=group_names, reset=True)
+            return len(face_ids)
+
+        new = ~clustered
+        nearest, distances = nearest_faces(embeddings[new], embeddings[clustered])
+        joins = distances <= FACE_CLUSTER_TOLERANCE
+        assignments = list(zip(cluster_ids[clustered][nearest[joins]].tolist(), face_ids[new][joins].tolist()))
+        unmatched = np.flatnonzero(new)[~joins]
+        new_groups = groups_from_labels(face_ids[unmatched], chinese_whispers(embeddings[unmatched])) if len(unmatched) else []
+        store.save_face_clusters(assignments, new_groups)
+        return int(new.sum())
+
+def list_face_clusters(store):
+    """
+    Returns one entry per face cluster, largest first: {"cluster_id", "name", "size",
+    "face_id" and "embedding" of the representative face (the one nearest the cluster's mean)}.
+    """
+    faces = store.load_face_table()
+    clustered = faces["cluster_ids"] >= 0
+    cluster_ids, face_ids, embeddings = faces["cluster_ids"][clustered], faces["face_ids"][clustered], faces["embeddings"][clustered]
+    if len(cluster_ids) == 0:
+        return []
+    unique_ids, inverse, sizes = np.unique(cluster_ids, return_inverse=True, return_counts=True)
+    sums = np.zeros((len(unique_ids), embeddings.shape[1]), dtype=np.float64)
+    np.add.at(sums, inverse, embeddings)
+    means = sums / sizes[:, None]
+    distances = np.linalg.norm(embeddings - means[inverse], axis=1)
+    # Sorting by (cluster, distance) puts each cluster's representative first
+    order = np.lexsort((distances, inverse))
+    representatives = order[np.searchsorted(inverse[order], np.arange(len(unique_ids)))]
+
+    names = store.face_cluster_names()
+    clusters = [{"cluster_id": int(cluster_id), "name": names.get(int(cluster_id)), "size": int(size),
+                 "face_id": int(face_ids[rep]), "embedding": embeddings[rep]}
+                for cluster_id, size, rep in zip(unique_ids, sizes, representatives)]
+    clusters.sort(key=lambda cluster: -cluster["size"])
+    return clusters
+
+def cluster_samples(store, cluster_id, max_samples=MAX_SAMPLES_PER_PERSON):
+    """
+    Picks up to `max_samples` faces from a cluster that cover it well: the one
+    nearest the cluster mean first, then repeatedly the face farthest from those picked.
+    """
+    faces = store.load_face_table()
+    members = faces["embeddings"][faces["cluster_ids"] == cluster_id]
+    if len(members) <= max_samples:
+        return members
+    picked = [int(np.argmin(np.linalg.norm(members - members.mean(axis=0), axis=1)))]
+    distances = np.linalg.norm(members - members[picked[0]], axis=1)
+    while len(picked) < max_samples:
+        picked.append(int(np.argmax(distances)))
+        distances = np.minimum(distances, np.linalg.norm(members - members[picked[-1]], axis=1))
+    return members[picked]
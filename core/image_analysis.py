@@ -0,0 +1,109 @@
+import os
+import io
+import hashlib
+import numpy as np
+from PIL import Image, ImageOps
+import pytesseract
+import face_recognition
+from .cleaner_logic import perceptual_hash
+
+# This module runs inside the indexer's worker processes, so it must stay
+# free of heavy imports like torch and sentence_transformers.
+
+THUMBNAIL_SIZE = (250, 250)
+CLIP_INPUT_SIZE = 224 # CLIP resizes the short side to 224 anyway
+FACE_DETECTION_MAX_SIDE = 1600 # HOG cost grows with pixel count; faces stay detectable at this size
+FACE_CHIP_SIZE = (150, 150) # Matches the People view cards
+FACE_CHIP_MARGIN = 0.25 # Extra context around the detected box, as a fraction of its size
+
+def scaled_to_short_side(image, short_side):
+    """Returns a downscaled copy whose short side is `short_side` (or the image itself if already smaller)."""
+    scale = short_side / min(image.size)
+    if scale >= 1:
+        return image
+    new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(new_size, Image.Resampling.BICUBIC, reducing_gap=2.0)
+
+def scaled_to_long_side(image, long_side):
+    """Returns (view, scale) where the view's long side is at most `long_side`."""
+    scale = long_side / max(image.size)
+    if scale >= 1:
+        return image, 1.0
+    new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(new_size, Image.Resampling.BILINEAR, reducing_gap=2.0), scale
+
+def detect_faces(rgb_image):
+    """
+    Runs HOG face detection on a bounded-size view of the image.
+    Locations are scaled back to original image coordinates.
+    """
+    face_view, scale = scaled_to_long_side(rgb_image, FACE_DETECTION_MAX_SIDE)
+    np_image = np.asarray(face_view)
+    view_locations = face_recognition.face_locations(np_image, model="hog")
+    face_encodings = face_recognition.face_encodings(np_image, view_locations)
+    face_locations = [
+        tuple(int(round(coord / scale)) for coord in location)
+        for location in view_locations
+    ]
+    return face_locations, [enc.tolist() for enc in face_encodings]
+
+def save_face_chip(rgb_image, location, chip_dir):
+    """
+    Crops one face (with some margin) from the full-resolution image and saves it
+    under a name derived from its content, so identical chips share one file.
+    Returns the chip path.
+    """
+    top, right, bottom, left = location
+    margin_x, margin_y = int((right - left) * FACE_CHIP_MARGIN), int((bottom - top) * FACE_CHIP_MARGIN)
+    box = (max(0, left - margin_x), max(0, top - margin_y),
+           min(rgb_image.width, right + margin_x), min(rgb_image.height, bottom + margin_y))
+    chip = ImageOps.fit(rgb_image.crop(box), FACE_CHIP_SIZE, Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    chip.save(buffer, "jpeg", quality=90)
+    chip_bytes = buffer.getvalue()
+    chip_path = os.path.join(chip_dir, f"{hashlib.blake2b(chip_bytes, digest_size=16).hexdigest()}.jpeg")
+    if not os.path.exists(chip_path):
+        with open(chip_path, 'wb') as f:
+            f.write(chip_bytes)
+    return chip_path
+
+def analyze_image_file(file_path, thumbnail_dir, mod_time, file_size, face_chip_dir=None):
+    """
+    Does all of the per-file CPU work except CLIP: decode, thumbnail, OCR, face detection,
+    the perceptual hash and (if `face_chip_dir` is given) the face chips shown in the People view.
+    The file is decoded once; every stage works from that one RGB buffer or a downscaled view of it.
+    Returns the partial index record and the small RGB view that still needs a CLIP embedding.
+    """
+    with Image.open(file_path) as pil_image:
+        original_width, original_height = pil_image.size
+        rgb_image = pil_image.convert('RGB')
+
+    # Create Thumbnail
+    thumbnail_filename = f"{hashlib.md5(file_path.encode()).hexdigest()}.jpeg"
+    thumbnail_path = os.path.join(thumbnail_dir, thumbnail_filename)
+    thumbnail = rgb_image.copy()
+    thumbnail.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+    thumbnail.save(thumbnail_path, "jpeg", quality=92)
+
+    # Extract Data
+    extracted_text = pytesseract.image_to_string(rgb_image, lang='eng') # OCR needs full resolution
+    face_locations, face_encodings_list = detect_faces(rgb_image)
+    face_chip_paths = [save_face_chip(rgb_image, location, face_chip_dir) for location in face_locations] if face_chip_dir else []
+    clip_view = scaled_to_short_side(rgb_image, CLIP_INPUT_SIZE)
+    phash = perceptual_hash(clip_view) # pHash works on a 32x32 grayscale copy, so the small view is plenty
+
+    screenshot_info = {
+        "file_path": file_path,
+        "thumbnail_path": thumbnail_path,
+        "text": extracted_text.strip(),
+        "clip_embedding": None, # Filled in by the CLIP stage
+        "face_embeddings": face_encodings_list,
+        "face_locations": face_locations,
+        "face_chip_paths": face_chip_paths,
+        "phash": phash,
+        "width": original_width,
+        "height": original_height,
+        "mod_time": mod_time, # Store for caching
+        "file_size": file_size # Store for caching
+    }
+    return screenshot_info, clip_view
@@ -0,0 +1,792 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+import numpy as np
+from .vector_index import (normalize_rows, choose_list_count, train_centroids, assign_lists,
+                           KMEANS_SAMPLE_SIZE, ASSIGN_CHUNK_SIZE)
+
+# --- CONFIGURATION ---
+APP_DIR = os.path.join(os.path.expanduser("~"), ".screenscorch")
+INDEX_DB_FILE = os.path.join(APP_DIR, "index.db")
+CLIP_VECTORS_FILE = os.path.join(APP_DIR, "clip_embeddings.f32")
+FACE_VECTORS_FILE = os.path.join(APP_DIR, "face_embeddings.f32")
+LEGACY_INDEX_FILE = os.path.join(APP_DIR, "master_index.json")
+CLIP_DIM = 512
+FACE_DIM = 128
+VECTOR_DTYPE = np.float32
+IVF_MIN_RECORDS = 10_000 # Train IVF lists from this size; the semantic duplicate join needs them before search does
+IVF_RETRAIN_GROWTH = 4 # Retrain the IVF lists once the library has grown this much since training
+SQL_BATCH_SIZE = 500 # Ids per IN (...) query, well under SQLite's variable limit
+CHANGE_LOG_GENERATIONS = 1000 # How far back readers can catch up on record changes without a full reload
+
+# --- GLOBAL CACHE ---
+store_cache = None
+store_cache_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_path TEXT NOT NULL UNIQUE,
+    thumbnail_path TEXT,
+    text TEXT NOT NULL DEFAULT '',
+    width INTEGER,
+    height INTEGER,
+    mod_time REAL,
+    file_size INTEGER,
+    clip_row INTEGER,
+    ivf_list INTEGER,
+    partial_hash TEXT,
+    content_hash TEXT,
+    hash_mod_time REAL,
+    hash_file_size INTEGER,
+    phash INTEGER
+);
+CREATE TABLE IF NOT EXISTS faces (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    record_id INTEGER NOT NULL REFERENCES records(id) ON DELETE CASCADE,
+    face_index INTEGER NOT NULL,
+    vector_row INTEGER NOT NULL,
+    top INTEGER, right INTEGER, bottom INTEGER, left INTEGER,
+    cluster_id INTEGER,
+    chip_path TEXT
+);
+CREATE INDEX IF NOT EXISTS faces_record_id ON faces(record_id);
+CREATE TABLE IF NOT EXISTS face_clusters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mod_time REAL NOT NULL,
+    subdirs TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS record_changes (
+    generation INTEGER NOT NULL,
+    record_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS record_changes_generation ON record_changes(generation);
+CREATE TABLE IF NOT EXISTS duplicate_groups (
+    kind TEXT NOT NULL,
+    record_id INTEGER NOT NULL,
+    group_id INTEGER NOT NULL,
+    PRIMARY KEY (kind, record_id)
+);
+"""
+
+def fts_schema(name, tokenize):
+    """
+    An FTS5 index over the OCR text, kept in sync with `records` by triggers
+    (external content: the text itself is only stored once, in `records`).
+    """
+    return f"""
+CREATE VIRTUAL TABLE {name} USING fts5(
+    text, content='records', content_rowid='id', tokenize='{tokenize}'
+);
+CREATE TRIGGER {name}_insert AFTER INSERT ON records BEGIN
+    INSERT INTO {name} (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER {name}_delete AFTER DELETE ON records BEGIN
+    INSERT INTO {name} ({name}, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+CREATE TRIGGER {name}_update AFTER UPDATE OF text ON records BEGIN
+    INSERT INTO {name} ({name}, rowid, text) VALUES ('delete', old.id, old.text);
+    INSERT INTO {name} (rowid, text) VALUES (new.id, new.text);
+END;
+INSERT INTO {name} ({name}) VALUES ('rebuild');
+"""
+
+# Word index for keyword search, and a character-trigram index for shortlisting fuzzy matches
+TEXT_INDEX_SCHEMA = fts_schema("text_index", "unicode61 remove_diacritics 2")
+TRIGRAM_INDEX_SCHEMA = fts_schema("trigram_index", "trigram")
+
+# Columns added after a table was first created: (table, column, declaration)
+COLUMN_MIGRATIONS = [
+    ("records", "ivf_list", "INTEGER"),
+    ("faces", "cluster_id", "INTEGER"),
+    ("faces", "chip_path", "TEXT"),
+    ("records", "partial_hash", "TEXT"),
+    ("records", "content_hash", "TEXT"),
+    ("records", "hash_mod_time", "REAL"),
+    ("records", "hash_file_size", "INTEGER"),
+    ("records", "phash", "INTEGER"),
+]
+
+# Indexes on migrated columns, created once the columns exist
+MIGRATED_INDEXES = """
+CREATE INDEX IF NOT EXISTS faces_chip_path ON faces(chip_path);
+"""
+
+
+def epoch_path(path, epoch):
+    """Vector files are renamed on every compaction: clip_embeddings.f32, clip_embeddings.1.f32, ..."""
+    if epoch == 0:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{epoch}{ext}"
+
+
+class VectorFile:
+    """An append-only file of fixed-width float32 rows that can be memory-mapped."""
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self.row_bytes = dim * np.dtype(VECTOR_DTYPE).itemsize
+
+    def row_count(self):
+        if not os.path.exists(self.path):
+            return 0
+        # A torn write can leave a partial row at the end; it is ignored (and overwritten on append).
+        return os.path.getsize(self.path) // self.row_bytes
+
+    def append(self, vectors):
+        """Appends rows and returns the row number of the first one."""
+        vectors = np.ascontiguousarray(vectors, dtype=VECTOR_DTYPE).reshape(-1, self.dim)
+        first_row = self.row_count()
+        mode = 'r+b' if os.path.exists(self.path) else 'wb'
+        with open(self.path, mode) as f:
+            f.seek(first_row * self.row_bytes)
+            f.write(vectors.tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+        return first_row
+
+    def matrix(self):
+        """Returns a read-only (rows x dim) memory map over the file."""
+        rows = self.row_count()
+        if rows == 0:
+            return np.empty((0, self.dim), dtype=VECTOR_DTYPE)
+        return np.memmap(self.path, dtype=VECTOR_DTYPE, mode='r', shape=(rows, self.dim))
+
+    def rewrite(self, vectors):
+        """Atomically replaces the whole file with the given rows."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(np.ascontiguousarray(vectors, dtype=VECTOR_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class IndexStore:
+    """
+    The master index: record metadata lives in SQLite, CLIP and face embeddings
+    live in memory-mapped float32 files that are only ever appended to.
+    Deleted records leave dead vector rows behind until `compact()` runs.
+    """
+
+    def __init__(self, db_path=INDEX_DB_FILE, clip_path=CLIP_VECTORS_FILE, face_path=FACE_VECTORS_FILE):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+        self.migrate_columns()
+        self.conn.executescript(MIGRATED_INDEXES)
+        self.has_text_index = self.create_fts_index("text_index", TEXT_INDEX_SCHEMA)
+        self.has_trigram_index = self.create_fts_index("trigram_index", TRIGRAM_INDEX_SCHEMA) # Needs SQLite 3.34+
+        self.local = threading.local()
+        self.clip_path, self.face_path = clip_path, face_path
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'vector_epoch'").fetchone()
+        self.epoch = row[0] if row else 0
+        self.clip_vectors = VectorFile(epoch_path(clip_path, self.epoch), CLIP_DIM)
+        self.face_vectors = VectorFile(epoch_path(face_path, self.epoch), FACE_DIM)
+        self.clip_centroids = self.load_clip_centroids()
+
+    def migrate_columns(self):
+        for table, column, declaration in COLUMN_MIGRATIONS:
+            existing = {row['name'] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+        self.conn.commit()
+
+    def create_fts_index(self, name, schema):
+        """Creates an FTS5 index on first use. Returns False if this SQLite build can't provide it."""
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+        if exists:
+            return True
+        try:
+            with self.conn:
+                self.conn.executescript("BEGIN;" + schema + "COMMIT;")
+            return True
+        except sqlite3.OperationalError as e:
+            self.conn.rollback()
+            print(f"⚠️ SQLite index '{name}' unavailable ({e}); search will fall back to scanning.")
+            return False
+
+    def read_connection(self):
+        """
+        A per-thread read-only connection. In WAL mode it reads the last committed
+        state without waiting on the indexer's write lock.
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self.local.conn = conn
+        return conn
+
+    # --- Reading ---
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def file_stats(self):
+        """Returns {file_path: (mod_time, file_size)} for change detection."""
+        with self.lock:
+            rows = self.conn.execute("SELECT file_path, mod_time, file_size FROM records").fetchall()
+        return {row['file_path']: (row['mod_time'], row['file_size']) for row in rows}
+
+    def generation(self):
+        """A counter bumped by every committed change, so readers can tell when their copy is stale."""
+        row = self.read_connection().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def changes_since(self, generation):
+        """
+        Returns (current_generation, ids of records added, updated or removed since
+        `generation`), or (current_generation, None) if the change log no longer
+        reaches back that far and the caller has to reload everything.
+        """
+        conn = self.read_connection()
+        with conn: # One read transaction, so the generation and the log agree
+            conn.execute("BEGIN")
+            values = dict(conn.execute(
+                "SELECT key, value FROM meta WHERE key IN ('generation', 'change_log_start')").fetchall())
+            current, log_start = values.get('generation', 0), values.get('change_log_start', 0)
+            if generation is None or generation < log_start:
+                return current, None
+            record_ids = [row[0] for row in conn.execute(
+                "SELECT DISTINCT record_id FROM record_changes WHERE generation > ? AND generation <= ?",
+                (generation, current))]
+        return current, record_ids
+
+    def search_text(self, query, limit=None):
+        """
+        Keyword search over the OCR text. The query's words must appear as a
+        phrase (the last word may be a prefix); results are (record_id, bm25_rank)
+        best first. Returns None when the full-text index is unavailable.
+        """
+        if not self.has_text_index:
+            return None
+        terms = re.findall(r"\w+", query.lower())
+        if not terms:
+            return []
+        match_expression = '"' + ' '.join(terms) + '"*'
+        sql = "SELECT rowid, bm25(text_index) AS rank FROM text_index WHERE text_index MATCH ? ORDER BY rank"
+        params = [match_expression]
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [(row[0], row[1]) for row in self.read_connection().execute(sql, params)]
+
+    def trigram_candidates(self, query, min_shared):
+        """
+        Returns the ids of records whose text shares at least `min_shared` of the
+        query's distinct character trigrams (case-insensitive), or None when the
+        trigram index is unavailable or the query is too short to have trigrams.
+        """
+        if not self.has_trigram_index:
+            return None
+        trigrams = {query[i:i + 3] for i in range(len(query) - 2)}
+        if not trigrams:
+            return None
+        conn = self.read_connection()
+        postings = [
+            np.fromiter((row[0] for row in conn.execute(
+                "SELECT rowid FROM trigram_index WHERE trigram_index MATCH ?",
+                ('"' + trigram.replace('"', '""') + '"',))), dtype=np.int64)
+            for trigram in trigrams
+        ]
+        ids, shared_counts = np.unique(np.concatenate(postings), return_counts=True)
+        return ids[shared_counts >= max(1, min_shared)]
+
+    def stats_for_paths(self, paths):
+        """Like file_stats(), but only for the given paths."""
+        with self.lock:
+            stats = {}
+            for path in paths:
+                row = self.conn.execute(
+                    "SELECT mod_time, file_size FROM records WHERE file_path = ?", (path,)).fetchone()
+                if row:
+                    stats[path] = (row['mod_time'], row['file_size'])
+            return stats
+
+    def paths_under(self, path):
+        """Returns the indexed file paths equal to `path` or inside it, if it is a directory."""
+        prefix = path.rstrip(os.sep) + os.sep
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT file_path FROM records WHERE file_path = ? OR substr(file_path, 1, ?) = ?",
+                (path, len(prefix), prefix)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def clip_matrix(self):
+        return self.clip_vectors.matrix()
+
+    def face_matrix(self):
+        return self.face_vectors.matrix()
+
+    def load_face_table(self):
+        """
+        Returns every indexed face as parallel arrays, ordered by record id then face:
+        {"face_ids", "record_ids", "face_indexes", "cluster_ids" (-1 = not clustered yet),
+         "embeddings" (one contiguous num_faces x 128 array)}.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, record_id, face_index, vector_row, IFNULL(cluster_id, -1) FROM faces "
+                "ORDER BY record_id, face_index").fetchall()
+            face_matrix = self.face_matrix()
+        columns = [np.array(column, dtype=np.int64) for column in zip(*rows)] or [np.empty(0, dtype=np.int64)] * 5
+        face_ids, record_ids, face_indexes, vector_rows, cluster_ids = columns
+        embeddings = np.asarray(face_matrix[vector_rows]) if rows else np.empty((0, FACE_DIM), dtype=VECTOR_DTYPE)
+        return {"face_ids": face_ids, "record_ids": record_ids, "face_indexes": face_indexes,
+                "cluster_ids": cluster_ids, "embeddings": embeddings}
+
+    def load_face_matrix(self):
+        """Returns (embeddings, owner_record_ids, face_indexes) for every indexed face."""
+        faces = self.load_face_table()
+        return faces["embeddings"], faces["record_ids"], faces["face_indexes"]
+
+    def get_faces(self, face_ids):
+        """Returns {face_id: row} with the face's location and its record's file and thumbnail details."""
+        with self.lock:
+            rows = [self.conn.execute(
+                "SELECT faces.id, faces.face_index, faces.top, faces.right, faces.bottom, faces.left, "
+                "faces.chip_path, records.file_path, records.thumbnail_path, records.width, records.height "
+                "FROM faces JOIN records ON records.id = faces.record_id WHERE faces.id = ?", (int(face_id),)
+            ).fetchone() for face_id in face_ids]
+        return {row['id']: dict(row) for row in rows if row}
+
+    def set_face_chip(self, face_id, chip_path):
+        """Records a chip generated after indexing (for faces indexed before chips existed)."""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE faces SET chip_path = ? WHERE id = ?", (chip_path, int(face_id)))
+
+    def load_records(self, include_embeddings=True, record_ids=None):
+        """
+        Loads every record (or just `record_ids`, skipping any that no longer exist)
+        in the same shape the old JSON index had, ordered by id.
+        Embeddings are zero-copy views into the memory-mapped vector files.
+        """
+        with self.lock:
+            if record_ids is None:
+                records = [dict(row) for row in self.conn.execute("SELECT * FROM records ORDER BY id")]
+                faces = self.conn.execute(
+                    "SELECT record_id, vector_row, top, right, bottom, left FROM faces ORDER BY record_id, face_index"
+                ).fetchall()
+            else:
+                record_ids = sorted(set(record_ids))
+                records, faces = [], []
+                for start in range(0, len(record_ids), SQL_BATCH_SIZE):
+                    batch = record_ids[start:start + SQL_BATCH_SIZE]
+                    placeholders = ','.join('?' * len(batch))
+                    records.extend(dict(row) for row in self.conn.execute(
+                        f"SELECT * FROM records WHERE id IN ({placeholders}) ORDER BY id", batch))
+                    faces.extend(self.conn.execute(
+                        "SELECT record_id, vector_row, top, right, bottom, left FROM faces "
+                        f"WHERE record_id IN ({placeholders}) ORDER BY record_id, face_index", batch))
+            clip_matrix = self.clip_matrix() if include_embeddings else None
+            face_matrix = self.face_matrix() if include_embeddings else None
+
+        faces_by_record = {}
+        for face in faces:
+            faces_by_record.setdefault(face['record_id'], []).append(face)
+
+        for record in records:
+            record_faces = faces_by_record.get(record['id'], [])
+            record['face_locations'] = [(f['top'], f['right'], f['bottom'], f['left']) for f in record_faces]
+            if include_embeddings:
+                record['clip_embedding'] = clip_matrix[record['clip_row']] if record['clip_row'] is not None else None
+                record['face_embeddings'] = [face_matrix[f['vector_row']] for f in record_faces]
+        return records
+
+    # --- Writing ---
+    def add_records(self, records):
+        """
+        Upserts records keyed by file_path. A changed file keeps its record id,
+        so replacing a record is a single indexed lookup rather than a scan.
+        Vectors are appended before the SQLite transaction commits, so a crash
+        at any point leaves at worst some unreferenced vector rows.
+        """
+        if not records:
+            return
+        with self.lock:
+            clip_embeddings = [r['clip_embedding'] for r in records if r.get('clip_embedding') is not None]
+            clip_row = self.clip_vectors.append(clip_embeddings) if clip_embeddings else None
+            face_embeddings = [enc for r in records for enc in r.get('face_embeddings', [])]
+            face_row = self.face_vectors.append(face_embeddings) if face_embeddings else None
+
+            # New vectors join their nearest IVF list right away; no retraining needed
+            ivf_lists = iter([])
+            if clip_embeddings and self.clip_centroids is not None:
+                ivf_lists = iter(assign_lists(self.clip_centroids, normalize_rows(clip_embeddings)).tolist())
+
+            record_rows = []
+            for record in records:
+                record_clip_row = record_ivf_list = None
+                if record.get('clip_embedding') is not None:
+                    record_clip_row = clip_row
+                    record_ivf_list = next(ivf_lists, None)
+                    clip_row += 1
+                record_rows.append((record['file_path'], record.get('thumbnail_path'), record.get('text', ''),
+                                    record.get('width'), record.get('height'), record.get('mod_time'),
+                                    record.get('file_size'), record_clip_row, record_ivf_list, record.get('phash')))
+
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO records (file_path, thumbnail_path, text, width, height, mod_time, file_size, clip_row, ivf_list, phash) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(file_path) DO UPDATE SET thumbnail_path = excluded.thumbnail_path, "
+                    "text = excluded.text, width = excluded.width, height = excluded.height, "
+                    "mod_time = excluded.mod_time, file_size = excluded.file_size, "
+                    "clip_row = excluded.clip_row, ivf_list = excluded.ivf_list, phash = excluded.phash",
+                    record_rows
+                )
+                record_ids = self.ids_for_paths([record['file_path'] for record in records])
+                old_chip_paths = self.chip_paths_for_records(record_ids)
+                self.conn.executemany("DELETE FROM faces WHERE record_id = ?", [(rid,) for rid in record_ids])
+
+                face_rows = []
+                for record, record_id in zip(records, record_ids):
+                    locations = record.get('face_locations', [])
+                    chip_paths = record.get('face_chip_paths') or []
+                    for i, _ in enumerate(record.get('face_embeddings', [])):
+                        top, right, bottom, left = locations[i] if i < len(locations) else (None, None, None, None)
+                        chip_path = chip_paths[i] if i < len(chip_paths) else None
+                        face_rows.append((record_id, i, face_row, top, right, bottom, left, chip_path))
+                        face_row += 1
+                self.conn.executemany(
+                    "INSERT INTO faces (record_id, face_index, vector_row, top, right, bottom, left, chip_path) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    face_rows
+                )
+                self.bump_generation(record_ids)
+            self.delete_unreferenced_chips(old_chip_paths)
+
+    def ids_for_paths(self, paths):
+        """Returns the record id for each path (None for unknown paths), in order."""
+        with self.lock:
+            return [row[0] if row else None for row in (
+                self.conn.execute("SELECT id FROM records WHERE file_path = ?", (path,)).fetchone()
+                for path in paths)]
+
+    def remove_paths(self, paths):
+        """
+        Deletes the records for the given file paths, along with their thumbnails.
+        Returns how many were removed.
+        """
+        paths = list(paths)
+        if not paths:
+            return 0
+        with self.lock:
+            with self.conn:
+                record_ids = self.ids_for_paths(paths)
+                old_chip_paths = self.chip_paths_for_records(record_ids)
+                thumbnail_paths = [row[0] for record_id in record_ids if record_id is not None for row in self.conn.execute(
+                    "SELECT thumbnail_path FROM records WHERE id = ? AND thumbnail_path IS NOT NULL", (record_id,))]
+                count_before = self.count()
+                self.conn.executemany("DELETE FROM records WHERE file_path = ?", [(path,) for path in paths])
+                removed = count_before - self.count()
+                if removed:
+                    self.bump_generation(record_ids)
+            self.delete_unreferenced_chips(old_chip_paths)
+            for path in thumbnail_paths: # Named after the file's path, so never shared
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            return removed
+
+    def chip_paths_for_records(self, record_ids):
+        with self.lock:
+            return [row[0] for record_id in record_ids if record_id is not None for row in self.conn.execute(
+                "SELECT chip_path FROM faces WHERE record_id = ? AND chip_path IS NOT NULL", (record_id,))]
+
+    def delete_unreferenced_chips(self, chip_paths):
+        """Face chips are shared by content, so a file is only deleted once no face uses it."""
+        with self.lock:
+            for path in set(chip_paths):
+                if self.conn.execute("SELECT 1 FROM faces WHERE chip_path = ? LIMIT 1", (path,)).fetchone():
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def compact(self, min_dead_fraction=0.5):
+        """
+        Rewrites the vector files without dead rows once enough of them have piled up.
+        The compacted rows go to new epoch-numbered files and the renumbering and
+        epoch switch commit together, so a crash never leaves rows pointing at the wrong file.
+        """
+        with self.lock:
+            clip_live = self.conn.execute(
+                "SELECT id, clip_row FROM records WHERE clip_row IS NOT NULL ORDER BY clip_row").fetchall()
+            face_live = self.conn.execute("SELECT id, vector_row FROM faces ORDER BY vector_row").fetchall()
+            clip_total, face_total = self.clip_vectors.row_count(), self.face_vectors.row_count()
+            if (clip_total - len(clip_live) <= min_dead_fraction * clip_total and
+                    face_total - len(face_live) <= min_dead_fraction * face_total):
+                return False
+
+            new_epoch = self.epoch + 1
+            new_clip_vectors = VectorFile(epoch_path(self.clip_path, new_epoch), CLIP_DIM)
+            new_face_vectors = VectorFile(epoch_path(self.face_path, new_epoch), FACE_DIM)
+            new_clip_vectors.rewrite(self.clip_matrix()[[row['clip_row'] for row in clip_live]])
+            new_face_vectors.rewrite(self.face_matrix()[[row['vector_row'] for row in face_live]])
+
+            with self.conn:
+                self.conn.executemany("UPDATE records SET clip_row = ? WHERE id = ?",
+                                      [(new_row, row['id']) for new_row, row in enumerate(clip_live)])
+                self.conn.executemany("UPDATE faces SET vector_row = ? WHERE id = ?",
+                                      [(new_row, row['id']) for new_row, row in enumerate(face_live)])
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('vector_epoch', ?)", (new_epoch,))
+                self.bump_generation(structural=True)
+
+            old_paths = (self.clip_vectors.path, self.face_vectors.path)
+            self.epoch = new_epoch
+            self.clip_vectors, self.face_vectors = new_clip_vectors, new_face_vectors
+            for path in old_paths:
+                if os.path.exists(path): os.remove(path)
+            return True
+
+    def bump_generation(self, changed_record_ids=(), structural=False):
+        """
+        Called inside the writer's transaction so the bump commits with the change.
+        The ids of added, updated or removed records are logged against the new
+        generation so readers can patch their caches instead of reloading. A
+        `structural` change (renumbered vectors, retrained IVF lists) can't be
+        patched: the log restarts and older readers must reload everything.
+        """
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('generation', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+        )
+        generation = self.conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+        log_start = None
+        if structural:
+            log_start = generation
+        elif generation % CHANGE_LOG_GENERATIONS == 0:
+            log_start = generation - CHANGE_LOG_GENERATIONS # Keep the log bounded
+        if log_start is not None:
+            self.conn.execute("DELETE FROM record_changes WHERE generation <= ?", (log_start,))
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('change_log_start', ?)", (log_start,))
+        if not structural:
+            self.conn.executemany("INSERT INTO record_changes (generation, record_id) VALUES (?, ?)",
+                                  [(generation, record_id) for record_id in changed_record_ids if record_id is not None])
+        return generation
+
+    # --- Duplicate Detection ---
+    def save_content_hashes(self, hashes):
+        """
+        Stores file hashes computed by the cleaner: (file_path, mod_time, file_size,
+        partial_hash, content_hash) rows. The hashes stay valid while the file's
+        mtime and size still match, so unchanged files are never read again.
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE records SET hash_mod_time = ?, hash_file_size = ?, partial_hash = ?, content_hash = ? "
+                "WHERE file_path = ?",
+                [(mod_time, file_size, partial_hash, content_hash, path)
+                 for path, mod_time, file_size, partial_hash, content_hash in hashes]
+            )
+
+    def save_phashes(self, phashes):
+        """Stores perceptual hashes computed for records indexed before they were: (file_path, phash) rows."""
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE records SET phash = ? WHERE file_path = ?",
+                                  [(phash, path) for path, phash in phashes])
+
+    # --- Duplicate Groups ---
+    def duplicate_groups_state(self):
+        """
+        Returns (generation, semantic_threshold) the saved duplicate groups are up to
+        date with; the generation is None if they were never computed.
+        """
+        with self.lock:
+            values = dict(self.conn.execute(
+                "SELECT key, value FROM meta WHERE key IN ('duplicates_generation', 'duplicates_threshold')").fetchall())
+        return values.get('duplicates_generation'), values.get('duplicates_threshold')
+
+    def load_duplicate_groups(self):
+        """Returns {kind: {group_id: [record ids]}}. Rows of removed records linger until the next update."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT kind, group_id, record_id FROM duplicate_groups ORDER BY kind, group_id, record_id").fetchall()
+        groups = {}
+        for row in rows:
+            groups.setdefault(row['kind'], {}).setdefault(row['group_id'], []).append(row['record_id'])
+        return groups
+
+    def save_duplicate_groups(self, groups, cleared_ids, generation, semantic_threshold, reset=False):
+        """
+        Applies a duplicate scan in one transaction. For each kind, the records in
+        `cleared_ids[kind]` leave their groups and each of `groups[kind]` (lists of
+        record ids) is stored under its lowest id. `reset` drops every group first.
+        """
+        with self.lock, self.conn:
+            if reset:
+                self.conn.execute("DELETE FROM duplicate_groups")
+            for kind, record_ids in cleared_ids.items():
+                self.conn.executemany("DELETE FROM duplicate_groups WHERE kind = ? AND record_id = ?",
+                                      [(kind, int(record_id)) for record_id in record_ids])
+            for kind, kind_groups in groups.items():
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO duplicate_groups (kind, record_id, group_id) VALUES (?, ?, ?)",
+                    [(kind, int(record_id), int(min(group))) for group in kind_groups for record_id in group])
+            self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                  [('duplicates_generation', generation), ('duplicates_threshold', semantic_threshold)])
+
+    # --- CLIP Vector Index ---
+    def load_clip_centroids(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'ivf_centroids'").fetchone()
+        if not row:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).reshape(-1, CLIP_DIM)
+
+    def train_clip_index(self, min_records=IVF_MIN_RECORDS, force=False):
+        """
+        (Re)builds the IVF lists over the CLIP embeddings once the library is
+        big enough, or has grown IVF_RETRAIN_GROWTH times since the last training.
+        Centroids and list assignments commit in one transaction.
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT id, clip_row FROM records WHERE clip_row IS NOT NULL").fetchall()
+            if len(rows) < min_records and not force:
+                return False
+            trained_row = self.conn.execute("SELECT value FROM meta WHERE key = 'ivf_trained_count'").fetchone()
+            trained_count = trained_row[0] if trained_row else 0
+            if (self.clip_centroids is not None and not force and
+                    len(rows) < IVF_RETRAIN_GROWTH * trained_count):
+                return False
+
+            clip_matrix = self.clip_matrix()
+            clip_rows = np.array([row['clip_row'] for row in rows])
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(clip_rows, min(len(clip_rows), KMEANS_SAMPLE_SIZE), replace=False))
+            centroids = train_centroids(normalize_rows(clip_matrix[sample_rows]), choose_list_count(len(rows)))
+
+            assignments = []
+            for start in range(0, len(rows), ASSIGN_CHUNK_SIZE):
+                chunk_rows = clip_rows[start:start + ASSIGN_CHUNK_SIZE]
+                chunk_lists = assign_lists(centroids, normalize_rows(clip_matrix[chunk_rows]))
+                assignments.extend(zip(chunk_lists.tolist(), (row['id'] for row in rows[start:start + ASSIGN_CHUNK_SIZE])))
+
+            with self.conn:
+                self.conn.executemany("UPDATE records SET ivf_list = ? WHERE id = ?", assignments)
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('ivf_centroids', ?)",
+                                  (centroids.astype(np.float32).tobytes(),))
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('ivf_trained_count', ?)",
+                                  (len(rows),))
+                self.bump_generation(structural=True)
+            self.clip_centroids = centroids.astype(np.float32)
+            return True
+
+    # --- Face Clusters ---
+    def save_face_clusters(self, assignments=(), new_groups=(), group_names=None, reset=False):
+        """
+        Applies a clustering pass in one transaction. `assignments` are (cluster_id, face_id)
+        pairs joining existing clusters; each of `new_groups` (lists of face ids) becomes a
+        new cluster, named from `group_names` if given. `reset` drops every cluster first.
+        Clusters left without faces are removed.
+        """
+        assignments = list(assignments)
+        group_names = group_names or [None] * len(new_groups)
+        with self.lock, self.conn:
+            if reset:
+                self.conn.execute("UPDATE faces SET cluster_id = NULL")
+                self.conn.execute("DELETE FROM face_clusters")
+            for group, name in zip(new_groups, group_names):
+                cluster_id = self.conn.execute("INSERT INTO face_clusters (name) VALUES (?)", (name,)).lastrowid
+                assignments.extend((cluster_id, int(face_id)) for face_id in group)
+            self.conn.executemany("UPDATE faces SET cluster_id = ? WHERE id = ?",
+                                  [(int(cluster_id), int(face_id)) for cluster_id, face_id in assignments])
+            self.conn.execute(
+                "DELETE FROM face_clusters WHERE id NOT IN "
+                "(SELECT DISTINCT cluster_id FROM faces WHERE cluster_id IS NOT NULL)")
+
+    def face_cluster_names(self):
+        """Returns {cluster_id: name or None}."""
+        with self.lock:
+            return {row['id']: row['name'] for row in self.conn.execute("SELECT id, name FROM face_clusters")}
+
+    def name_face_cluster(self, cluster_id, name):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE face_clusters SET name = ? WHERE id = ?", (name, int(cluster_id)))
+
+    # --- Directory Fingerprints ---
+    def directory_cache(self):
+        """Returns {dir_path: (mod_time, [subdir names])} recorded by the last completed scan."""
+        with self.lock:
+            rows = self.conn.execute("SELECT path, mod_time, subdirs FROM directories").fetchall()
+        return {row['path']: (row['mod_time'], json.loads(row['subdirs'])) for row in rows}
+
+    def update_directories(self, directories, removed_paths=()):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO directories (path, mod_time, subdirs) VALUES (?, ?, ?)",
+                [(path, mod_time, json.dumps(subdirs)) for path, (mod_time, subdirs) in directories.items()]
+            )
+            self.conn.executemany("DELETE FROM directories WHERE path = ?", [(path,) for path in removed_paths])
+
+    # --- Imported Roots ---
+    def imported_roots(self):
+        """Folders the user has imported; these are what watch mode monitors."""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'imported_roots'").fetchone()
+        return json.loads(row[0]) if row else []
+
+    def add_imported_root(self, path):
+        path = os.path.normpath(path)
+        roots = self.imported_roots()
+        if path in roots:
+            return
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported_roots', ?)",
+                              (json.dumps(roots + [path]),))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def migrate_legacy_index(store, status_callback=None):
+    """One-time import of the old master_index.json into the store."""
+    if not os.path.exists(LEGACY_INDEX_FILE) or store.count() > 0:
+        return False
+    if status_callback: status_callback("Migrating master_index.json to the new index format...")
+    try:
+        with open(LEGACY_INDEX_FILE, 'r', encoding='utf-8') as f:
+            legacy_data = json.load(f)
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"⚠️ Could not read legacy index for migration: {e}")
+        return False
+
+    store.add_records([item for item in legacy_data if 'file_path' in item])
+    store.train_clip_index() # Large migrated libraries get their IVF lists now, not on the next full import
+    os.replace(LEGACY_INDEX_FILE, LEGACY_INDEX_FILE + ".migrated")
+    if status_callback: status_callback(f"✅ Migrated {len(legacy_data)} records.")
+    return True
+
+
+def get_store(status_callback=None):
+    """Returns the shared IndexStore, opening it (and migrating the JSON index) on first use."""
+    global store_cache
+    with store_cache_lock:
+        if store_cache is None:
+            store_cache = IndexStore()
+            migrate_legacy_index(store_cache, status_callback)
+        return store_cache
@@ -1,159 +1,361 @@
 import os
-import json
-from PIL import Image
-import pytesseract
-import face_recognition
-from sentence_transformers import SentenceTransformer
 import time
-import hashlib
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from send2trash import send2trash
+from .index_store import get_store
+from .image_analysis import analyze_image_file
+from .scanner import scan_folder, scan_paths, is_image_path
+from .face_logic import update_face_clusters
+from .cleaner_logic import update_duplicate_groups
 
 CLIP_MODEL_NAME = 'clip-ViT-B-32'
 clip_model_cache = None
+# Full imports and watch-mode updates must not run their pipelines concurrently
+indexing_lock = threading.RLock()
 
-def build_master_index(paths_to_scan, on_complete=None, status_callback=None):
+APP_DIR = os.path.join(os.path.expanduser("~"), ".screenscorch")
+THUMBNAIL_DIR = os.path.join(APP_DIR, "thumbnails")
+FACE_CHIP_DIR = os.path.join(APP_DIR, "face_chips")
+
+# --- PIPELINE CONFIGURATION ---
+DEFAULT_NUM_WORKERS = max(1, (os.cpu_count() or 2) - 1) # Leave one core for the CLIP stage
+MIN_CLIP_BATCH_SIZE = 4
+MAX_CLIP_BATCH_SIZE = 256
+CLIP_MEMORY_FRACTION = 0.25 # Share of available RAM one CLIP batch may use
+CLIP_BYTES_PER_IMAGE = 8 * 1024 * 1024 # Rough cost of one image inside the model (tensors + activations)
+CHECKPOINT_EVERY_RECORDS = 500
+CHECKPOINT_EVERY_SECONDS = 60
+PENDING_FILES_PER_WORKER = 4 # Bounds how far discovery can run ahead of the workers
+CLIP_QUEUE_SIZE = 64 # Bounds how far the workers can run ahead of CLIP
+
+def available_memory_bytes():
+    """Best-effort free RAM. macOS has no SC_AVPHYS_PAGES, so fall back to a quarter of physical RAM."""
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        pass
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 4
+    except (ValueError, OSError, AttributeError):
+        return 2 * 1024 ** 3
+
+def clip_memory_budget():
+    return int(available_memory_bytes() * CLIP_MEMORY_FRACTION)
+
+def adaptive_clip_batch_size(memory_budget, max_batch_size=MAX_CLIP_BATCH_SIZE):
+    """How many images fit in one CLIP forward pass under the given memory budget."""
+    return max(MIN_CLIP_BATCH_SIZE, min(max_batch_size, memory_budget // CLIP_BYTES_PER_IMAGE))
+
+def run_clip_stage(clip_queue, on_records_encoded, max_batch_size=MAX_CLIP_BATCH_SIZE, status_callback=None):
     """
-    Scans image files and generates or UPDATES a master index.
-    - Can accept a folder path or a list of individual file paths.
-    - Skips files that have already been indexed and haven't changed.
-    - Removes entries from the index if the source file is deleted.
+    Stage 3: drains (record, image) pairs from the queue and encodes them in batches.
+    A batch is flushed once it reaches the adaptive batch size or the decoded
+    images it holds reach the memory budget. Finished records are handed to
+    `on_records_encoded` one batch at a time. A None item marks the end of the stream.
     """
-    global clip_model_cache
-    
-    APP_DIR = os.path.join(os.path.expanduser("~"), ".screenscorch")
-    THUMBNAIL_DIR = os.path.join(APP_DIR, "thumbnails")
-    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
-    MASTER_INDEX_FILE = os.path.join(APP_DIR, "master_index.json")
+    batch = []
+    batch_bytes = 0
+    memory_budget = clip_memory_budget()
+    batch_size = adaptive_clip_batch_size(memory_budget, max_batch_size)
+    encoded_count = 0
+    encode_seconds = 0.0
 
-    # --- 1. Load Existing Index and Create Cache ---
-    master_data = []
-    existing_files_cache = {}
-    if os.path.exists(MASTER_INDEX_FILE):
+    def flush():
+        nonlocal batch_bytes, memory_budget, batch_size, encoded_count, encode_seconds
         try:
-            with open(MASTER_INDEX_FILE, 'r', encoding='utf-8') as f:
-                master_data = json.load(f)
-            # Create a cache for quick lookups: {path: (mod_time, size)}
-            for item in master_data:
-                if 'mod_time' in item and 'file_size' in item:
-                    existing_files_cache[item['file_path']] = (item['mod_time'], item['file_size'])
-            if status_callback: status_callback(f"Loaded {len(master_data)} existing records.")
-        except (json.JSONDecodeError, IOError):
-            if status_callback: status_callback("⚠️ Could not read existing index. Starting fresh.")
-            master_data = []
-
-    if status_callback: status_callback("Loading AI models...")
-    
+            start_time = time.perf_counter()
+            embeddings = clip_model_cache.encode([image for _, image in batch], batch_size=len(batch))
+            encode_seconds += time.perf_counter() - start_time
+            for (record, _), embedding in zip(batch, embeddings):
+                record['clip_embedding'] = embedding.tolist()
+            on_records_encoded([record for record, _ in batch])
+            encoded_count += len(batch)
+            if status_callback:
+                status_callback(f"🧠 Encoded {encoded_count} images with CLIP "
+                                f"({encoded_count / encode_seconds:.1f} images/sec, batch size {len(batch)})")
+        except Exception as e:
+            print(f"\n❌ Error encoding a batch of {len(batch)} images: {e}")
+        batch.clear()
+        batch_bytes = 0
+        # Re-check free RAM so the next batch adapts to memory pressure
+        memory_budget = clip_memory_budget()
+        batch_size = adaptive_clip_batch_size(memory_budget, max_batch_size)
+
+    while True:
+        item = clip_queue.get()
+        if item is None:
+            break
+        batch.append(item)
+        width, height = item[1].size
+        batch_bytes += width * height * 3 + CLIP_BYTES_PER_IMAGE
+        if len(batch) >= batch_size or batch_bytes >= memory_budget:
+            flush()
+    if batch:
+        flush()
+
+def load_clip_model():
+    global clip_model_cache
     if clip_model_cache is None:
+        from sentence_transformers import SentenceTransformer # Heavy; only needed once there is something to embed
         clip_model_cache = SentenceTransformer(CLIP_MODEL_NAME)
+    return clip_model_cache
+
+def index_files(files_to_process, store, status_callback=None,
+                num_workers=None, max_clip_batch_size=MAX_CLIP_BATCH_SIZE):
+    """
+    Runs (file_path, mod_time, file_size) entries through the worker pool and
+    CLIP stage, committing records to the store in checkpoints.
+    Returns (number of files indexed, paths that failed and were not saved).
+    """
+    num_workers = min(num_workers or DEFAULT_NUM_WORKERS, max(1, len(files_to_process)))
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    os.makedirs(FACE_CHIP_DIR, exist_ok=True)
+
+    # --- Start the CLIP Stage and Checkpointing ---
+    unsaved_records = []
+    saved_paths = set()
+    newly_indexed_count = 0
+    last_checkpoint_time = time.monotonic()
 
-    if status_callback: status_callback("Gathering files to process...")
-
-    # --- 2. Determine the full list of files to process ---
-    image_extensions = {'.png', '.jpg', '.jpeg', '.heic', '.webp'}
-    files_to_process = []
-    
-    # If a single folder path is given
-    if isinstance(paths_to_scan, str) and os.path.isdir(paths_to_scan):
-        for root, _, files in os.walk(paths_to_scan):
-            for filename in files:
-                if os.path.splitext(filename)[1].lower() in image_extensions:
-                    files_to_process.append(os.path.join(root, filename))
-    # If a list of file paths is given
-    elif isinstance(paths_to_scan, list):
-        files_to_process = paths_to_scan
+    def save_checkpoint(force=False):
+        # Each checkpoint is one store transaction: it either fully lands or leaves the index untouched.
+        nonlocal newly_indexed_count, last_checkpoint_time
+        if not unsaved_records:
+            return
+        if not force and len(unsaved_records) < CHECKPOINT_EVERY_RECORDS and \
+                time.monotonic() - last_checkpoint_time < CHECKPOINT_EVERY_SECONDS:
+            return
+        try:
+            store.add_records(unsaved_records)
+        except Exception as e:
+            # Keep the records so the next checkpoint retries them
+            print(f"\n❌ Error saving checkpoint: {e}")
+            if force: raise
+            return
+        newly_indexed_count += len(unsaved_records)
+        saved_paths.update(record['file_path'] for record in unsaved_records)
+        unsaved_records.clear()
+        last_checkpoint_time = time.monotonic()
+        if status_callback: status_callback(f"💾 Checkpoint saved ({newly_indexed_count} files indexed so far).")
+
+    def on_records_encoded(records):
+        unsaved_records.extend(records)
+        save_checkpoint()
 
     if not files_to_process:
-        if status_callback: status_callback("🤷 No new image files found to process.")
-        if on_complete: on_complete()
-        return
+        return 0, []
+    load_clip_model()
+    clip_queue = queue.Queue(maxsize=CLIP_QUEUE_SIZE)
+    clip_thread = threading.Thread(target=run_clip_stage, args=(clip_queue, on_records_encoded, max_clip_batch_size, status_callback))
+    clip_thread.start()
 
-    total_images = len(files_to_process)
-    if status_callback: status_callback(f"Found {total_images} total images. Comparing with index...")
+    # --- Feed Files Through the Worker Pool ---
+    submitted_count = 0
+    analyzed_count = 0
+    max_pending = num_workers * PENDING_FILES_PER_WORKER
 
-    # --- 3. Main Processing Loop ---
-    newly_indexed_count = 0
-    processed_paths = set()
+    def collect(done_futures):
+        nonlocal analyzed_count
+        for future in done_futures:
+            file_path = pending.pop(future)
+            try:
+                record, clip_image = future.result()
+            except Exception as e:
+                # Using print for critical errors that should appear in the console
+                print(f"\n❌ Error processing {os.path.basename(file_path)}: {e}")
+                continue
+            analyzed_count += 1
+            if status_callback:
+                status_callback(f"Processing [{analyzed_count}/{len(files_to_process)}]: {os.path.basename(file_path)}")
+            clip_queue.put((record, clip_image)) # Blocks while CLIP is behind
+
+    pending = {}
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            for file_path, mod_time, file_size in files_to_process:
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                future = pool.submit(analyze_image_file, file_path, THUMBNAIL_DIR, mod_time, file_size, FACE_CHIP_DIR)
+                pending[future] = file_path
+                submitted_count += 1
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+    finally:
+        clip_queue.put(None)
+        clip_thread.join()
+
+    save_checkpoint(force=True)
+    # Failed to decode or analyze, lost in a failed CLIP batch, or never checkpointed
+    failed_paths = [file_path for file_path, _, _ in files_to_process if file_path not in saved_paths]
+    return newly_indexed_count, failed_paths
+
+def forget_directories_of(store, failed_paths):
+    """Drops the fingerprints of directories holding failed files, so the next import lists them and retries."""
+    unfinished_dirs = {os.path.dirname(path) for path in failed_paths}
+    if unfinished_dirs:
+        store.update_directories({}, unfinished_dirs)
+
+def build_master_index(paths_to_scan, on_complete=None, status_callback=None,
+                       num_workers=None, max_clip_batch_size=MAX_CLIP_BATCH_SIZE, full_rescan=False):
+    """
+    Scans image files and generates or UPDATES a master index.
+    - Can accept a folder path or a list of individual file paths.
+    - Skips files that have already been indexed and haven't changed.
+    - Removes entries from the index if the source file is deleted.
+    - Skips listing directories whose mtime is unchanged since the last scan
+      (pass full_rescan=True to stat every file again).
+    - Commits finished records in periodic checkpoints, so an interrupted run
+      resumes where it stopped (already-saved files are skipped as unchanged).
+    Files flow through a pipeline: discovery -> a process pool for decode,
+    thumbnail, OCR and face detection -> a CLIP stage that batches to fit free RAM.
+    """
+    with indexing_lock:
+        # --- 1. Open the Index Store and Create Cache ---
+        store = get_store(status_callback)
+        # A cache for quick lookups: {path: (mod_time, size)}
+        existing_files_cache = store.file_stats()
+        if status_callback: status_callback(f"Loaded {len(existing_files_cache)} existing records.")
+
+        if status_callback: status_callback("Gathering files to process...")
+
+        # --- 2. Discover New, Changed and Deleted Files ---
+        if isinstance(paths_to_scan, str) and os.path.isdir(paths_to_scan):
+            store.add_imported_root(paths_to_scan)
+            scan = scan_folder(paths_to_scan, existing_files_cache, store.directory_cache(), full_rescan)
+        elif isinstance(paths_to_scan, list):
+            scan = scan_paths(paths_to_scan, existing_files_cache)
+        else:
+            scan = {"added": [], "changed": [], "deleted": [], "directories": {}, "removed_directories": []}
+        files_to_process = scan["added"] + scan["changed"]
+        if status_callback:
+            status_callback(f"Found {len(scan['added'])} new, {len(scan['changed'])} changed and "
+                            f"{len(scan['deleted'])} deleted files.")
+        if not files_to_process:
+            if status_callback: status_callback("🤷 No new image files found to process.")
+        else:
+            if status_callback: status_callback("Loading AI models...")
 
-    for i, file_path in enumerate(files_to_process):
-        processed_paths.add(file_path)
         try:
-            # --- Caching Logic ---
-            mod_time = os.path.getmtime(file_path)
-            file_size = os.path.getsize(file_path)
-            
-            if file_path in existing_files_cache:
-                cached_mod_time, cached_file_size = existing_files_cache[file_path]
-                # If file hasn't changed, skip it
-                if mod_time == cached_mod_time and file_size == cached_file_size:
-                    continue
-                else: # File has changed, remove old entry before re-indexing
-                    master_data = [item for item in master_data if item['file_path'] != file_path]
-            
-            # --- Process New or Changed File ---
-            if status_callback:
-                status_callback(f"Processing [{i+1}/{total_images}]: {os.path.basename(file_path)}")
-            
-            pil_image = Image.open(file_path)
-            original_width, original_height = pil_image.size
-
-            # Create Thumbnail
-            thumbnail_filename = f"{hashlib.md5(file_path.encode()).hexdigest()}.jpeg"
-            thumbnail_path = os.path.join(THUMBNAIL_DIR, thumbnail_filename)
-            img_copy = pil_image.copy()
-            img_copy.thumbnail((250, 250), Image.Resampling.LANCZOS)
-            if img_copy.mode in ('RGBA', 'P', 'LA'):
-                img_copy = img_copy.convert('RGB')
-            img_copy.save(thumbnail_path, "jpeg", quality=92)
-
-            # Extract Data
-            extracted_text = pytesseract.image_to_string(pil_image, lang='eng')
-            clip_embedding = clip_model_cache.encode(pil_image).tolist()
-            np_image = face_recognition.load_image_file(file_path)
-            face_locations = face_recognition.face_locations(np_image, model="hog") # Using better model
-            face_encodings = face_recognition.face_encodings(np_image, face_locations)
-            face_encodings_list = [enc.tolist() for enc in face_encodings]
-
-            screenshot_info = {
-                "file_path": file_path,
-                "thumbnail_path": thumbnail_path,
-                "text": extracted_text.strip(),
-                "clip_embedding": clip_embedding,
-                "face_embeddings": face_encodings_list,
-                "face_locations": face_locations,
-                "width": original_width,  
-                "height": original_height,
-                "mod_time": mod_time, # Store for caching
-                "file_size": file_size # Store for caching
-            }
-            master_data.append(screenshot_info)
-            newly_indexed_count += 1
+            # --- 3. Index New and Changed Files ---
+            newly_indexed_count, failed_paths = index_files(files_to_process, store, status_callback,
+                                                            num_workers, max_clip_batch_size)
 
-        except Exception as e:
-            # Using print for critical errors that should appear in the console
-            print(f"\n❌ Error processing {os.path.basename(file_path)}: {e}")
+            # --- 4. Prune Deleted Files ---
+            if status_callback: status_callback("Cleaning up index...")
+            deleted_count = store.remove_paths(scan["deleted"])
+            # Only fingerprint directories once their files are safely in the index
+            store.update_directories(scan["directories"], scan["removed_directories"])
+            forget_directories_of(store, failed_paths)
+            store.compact()
+            if store.train_clip_index() and status_callback:
+                status_callback("🧭 Rebuilt the visual search index.")
+            update_face_clusters(store, status_callback=status_callback)
+            update_saved_duplicate_groups(store, status_callback)
 
-    # --- 4. Prune Deleted Files ---
-    if status_callback: status_callback("Cleaning up index...")
-    initial_count = len(master_data)
-    # Check if files in the original index still exist on disk
-    master_data = [item for item in master_data if os.path.exists(item['file_path'])]
-    deleted_count = initial_count - len(master_data)
+            final_message = f"✅ Indexing complete! Indexed {newly_indexed_count} new/changed files. "
+            if deleted_count > 0:
+                final_message += f"Removed {deleted_count} deleted files. "
+            if failed_paths:
+                final_message += f"{len(failed_paths)} files failed and will be retried next time. "
+            final_message += f"Total: {store.count()} items."
+            if status_callback: status_callback(final_message)
 
-    # --- 5. Save Final Index ---
-    try:
-        with open(MASTER_INDEX_FILE, 'w', encoding='utf-8') as f:
-            json.dump(master_data, f)
-        
-        final_message = f"✅ Indexing complete! Indexed {newly_indexed_count} new/changed files. "
-        if deleted_count > 0:
-            final_message += f"Removed {deleted_count} deleted files. "
-        final_message += f"Total: {len(master_data)} items."
-        if status_callback: status_callback(final_message)
-
-    except Exception as e:
-        error_message = f"❌ Critical error saving master index: {e}"
-        if status_callback: status_callback(error_message)
-        print(error_message)
-    
-    # --- 6. Signal Completion ---
+        except Exception as e:
+            error_message = f"❌ Critical error saving master index: {e}"
+            if status_callback: status_callback(error_message)
+            print(error_message)
+
+    # --- 5. Signal Completion ---
     if on_complete:
-        on_complete()
\ No newline at end of file
+        on_complete()
+
+def update_saved_duplicate_groups(store, status_callback=None):
+    """Patches the Cleaner's saved duplicate groups for this run's changes, once it has computed them."""
+    duplicates_generation, semantic_threshold = store.duplicate_groups_state()
+    if duplicates_generation is not None:
+        update_duplicate_groups(store, semantic_threshold=semantic_threshold, status_callback=status_callback)
+
+def update_index_for_paths(changed_paths, deleted_paths, status_callback=None):
+    """
+    Incrementally applies file system events without rescanning any folder.
+    `changed_paths` may be new or modified image files (or new directories);
+    `deleted_paths` may be files or whole directories.
+    Returns (indexed_count, removed_count).
+    """
+    with indexing_lock:
+        store = get_store(status_callback)
+
+        files_to_check = set()
+        for path in changed_paths:
+            if os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    files_to_check.update(os.path.join(root, name) for name in files if is_image_path(name))
+            elif is_image_path(path):
+                files_to_check.add(path)
+
+        removed_paths = set()
+        for path in deleted_paths:
+            removed_paths.update(store.paths_under(path))
+        known_stats = store.stats_for_paths(files_to_check)
+
+        files_to_process = []
+        for path in files_to_check:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                removed_paths.add(path)
+                continue
+            if known_stats.get(path) != (stat.st_mtime, stat.st_size):
+                files_to_process.append((path, stat.st_mtime, stat.st_size))
+
+        try:
+            indexed_count, failed_paths = index_files(files_to_process, store, status_callback)
+            forget_directories_of(store, failed_paths)
+            removed_count = store.remove_paths(removed_paths)
+            update_face_clusters(store)
+            update_saved_duplicate_groups(store)
+        except Exception as e:
+            error_message = f"❌ Critical error updating master index: {e}"
+            if status_callback: status_callback(error_message)
+            print(error_message)
+            return 0, 0
+        return indexed_count, removed_count
+
+def trash_files(paths, status_callback=None):
+    """
+    Moves files to the Trash in one batch, then drops their records, thumbnails,
+    face clusters and duplicate groups from the index in a single update.
+    Returns (trashed_paths, [(path, error)] for files that could not be trashed).
+    """
+    paths = [path for path in dict.fromkeys(paths) if os.path.exists(path)]
+    errors = []
+    if paths:
+        try:
+            send2trash(paths)
+        except Exception:
+            # The batch stops at the first failure; retry whatever is left one by one to see which files failed
+            for path in paths:
+                if os.path.exists(path):
+                    try:
+                        send2trash(path)
+                    except Exception as e:
+                        errors.append((path, e))
+    trashed = [path for path in paths if not os.path.exists(path)]
+    if not trashed:
+        return trashed, errors
+
+    with indexing_lock:
+        store = get_store(status_callback)
+        try:
+            store.remove_paths(trashed)
+            update_face_clusters(store)
+            update_saved_duplicate_groups(store)
+        except Exception as e:
+            error_message = f"❌ Critical error updating master index: {e}"
+            if status_callback: status_callback(error_message)
+            print(error_message)
+    return trashed, errors
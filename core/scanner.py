@@ -0,0 +1,114 @@
+import os
+import time
+from collections import defaultdict
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.heic', '.webp'}
+MTIME_RESOLUTION_SECONDS = 2.0 # Coarsest common mtime granularity (FAT/exFAT); finer file systems are covered too
+
+def is_image_path(path):
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+def is_under(path, root):
+    return path == root or path.startswith(root + os.sep)
+
+def scan_folder(root, existing_files_cache, directory_cache, full_rescan=False):
+    """
+    Walks a folder with os.scandir and compares it against the index.
+    A directory whose mtime matches the cached fingerprint has had no files
+    added, removed or renamed, so its files are not listed or stat'ed again;
+    only its subdirectories are visited. Use full_rescan to also catch files
+    that were edited in place inside unchanged directories.
+    A directory (or a file in it) modified within MTIME_RESOLUTION_SECONDS of
+    the listing is not fingerprinted: a write landing just after the listing
+    might not move its mtime, so it is listed again next time.
+
+    Returns {"added": [(path, mod_time, size)], "changed": [...], "deleted": [paths],
+             "directories": {dir_path: (mod_time, subdirs)}, "removed_directories": [dir_paths]}.
+    """
+    root = os.path.normpath(root)
+    indexed_by_dir = defaultdict(list)
+    for path in existing_files_cache:
+        indexed_by_dir[os.path.dirname(path)].append(path)
+
+    result = {"added": [], "changed": [], "deleted": [], "directories": {}, "removed_directories": []}
+    unreadable_dirs = set()
+    unsettled_dirs = set()
+    stack = [root]
+    while stack:
+        dir_path = stack.pop()
+        try:
+            dir_mod_time = os.stat(dir_path).st_mtime
+        except OSError:
+            continue
+
+        cached = directory_cache.get(dir_path)
+        if cached and cached[0] == dir_mod_time and not full_rescan:
+            result["directories"][dir_path] = cached
+            stack.extend(os.path.join(dir_path, name) for name in cached[1])
+            continue
+
+        subdirs = []
+        present = set()
+        listed_at = time.time()
+        newest_mod_time = dir_mod_time
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif is_image_path(entry.name) and entry.is_file():
+                        stat = entry.stat()
+                        newest_mod_time = max(newest_mod_time, stat.st_mtime)
+                        present.add(entry.path)
+                        cached_stat = existing_files_cache.get(entry.path)
+                        if cached_stat is None:
+                            result["added"].append((entry.path, stat.st_mtime, stat.st_size))
+                        elif cached_stat != (stat.st_mtime, stat.st_size):
+                            result["changed"].append((entry.path, stat.st_mtime, stat.st_size))
+        except OSError:
+            # Leave unreadable directories (and whatever we indexed there) alone
+            unreadable_dirs.add(dir_path)
+            continue
+
+        result["deleted"].extend(path for path in indexed_by_dir.get(dir_path, []) if path not in present)
+        if listed_at - newest_mod_time < MTIME_RESOLUTION_SECONDS:
+            unsettled_dirs.add(dir_path)
+        else:
+            result["directories"][dir_path] = (dir_mod_time, subdirs)
+        stack.extend(os.path.join(dir_path, name) for name in subdirs)
+
+    # Anything under the root we expected but did not reach has been removed;
+    # unsettled directories drop their old fingerprint so they are listed again
+    reached = result["directories"].keys() | unreadable_dirs | unsettled_dirs
+    result["removed_directories"] = [
+        path for path in directory_cache if is_under(path, root) and (path not in reached or path in unsettled_dirs)
+    ]
+    for dir_path, paths in indexed_by_dir.items():
+        if is_under(dir_path, root) and dir_path not in reached:
+            result["deleted"].extend(paths)
+    return result
+
+def scan_paths(paths, existing_files_cache):
+    """
+    Compares an explicit list of files (e.g. from Spotlight) against the index.
+    Each listed file is stat'ed once. Only indexed files missing from the list are
+    checked for existence, so the prune no longer touches every record.
+    """
+    result = {"added": [], "changed": [], "deleted": [], "directories": {}, "removed_directories": []}
+    listed = set()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue # Picked up below if it was indexed
+        listed.add(path)
+        cached_stat = existing_files_cache.get(path)
+        if cached_stat is None:
+            result["added"].append((path, stat.st_mtime, stat.st_size))
+        elif cached_stat != (stat.st_mtime, stat.st_size):
+            result["changed"].append((path, stat.st_mtime, stat.st_size))
+
+    result["deleted"].extend(
+        path for path in existing_files_cache if path not in listed and not os.path.exists(path)
+    )
+    return result
@@ -1,104 +1,457 @@
-import os
-import json
+import threading
+from collections import OrderedDict
 import numpy as np
 import torch
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer
 from thefuzz import fuzz
-from .face_logic import load_known_faces 
+from . import face_logic
+from .face_logic import get_known_faces, nearest_faces, FACE_MATCH_TOLERANCE
+from .index_store import get_store
+from .vector_index import IVFIndex, normalize_rows
 
 # --- CONFIGURATION ---
-APP_DIR = os.path.join(os.path.expanduser("~"), ".screenscorch")
-MASTER_INDEX_FILE = os.path.join(APP_DIR, "master_index.json")
 CLIP_MODEL_NAME = 'clip-ViT-B-32'
 FUZZY_MATCH_THRESHOLD = 85
+USE_APPROXIMATE_VISUAL_SEARCH = True # Set False (or pass exact=True) to brute-force CLIP, e.g. for recall checks
+APPROXIMATE_SEARCH_MIN_RECORDS = 100_000 # Below this, exact CLIP search is fast enough and misses nothing
+IVF_NPROBE = None # IVF lists scored per approximate query (None = the index's default); raise for recall, lower for speed
+
+DELTA_REBUILD_FRACTION = 0.2 # Reload from scratch once this share of the cached records has changed since the last full load
+CANCEL_CHECK_INTERVAL = 1024 # Records scored between checks for a newer query
+CLIP_SPARE_CAPACITY = 1.25 # Headroom in the resident CLIP matrix so new rows can be added without copying
+QUERY_CACHE_SIZE = 128 # Recent query embeddings and result sets kept for search-as-you-type
 
 # --- GLOBAL CACHE ---
+# Every cache below is only read or changed while holding search_index_lock.
 clip_model_cache = None
-master_index_cache = None
+master_index_generation = None
+record_by_id_cache = None # {record id: record}, in index order
+text_lower_by_id_cache = None # Lowercased OCR text, computed once per record instead of per query
+text_length_order_cache = None # (sorted text lengths, record ids in that order) for short-text lookups
+face_matrix_cache = None # Every indexed face encoding as one (num_faces x 128) matrix...
+face_owner_ids_cache = None # ...and the record id each row belongs to
+# The visual tier works on one pre-normalized matrix that stays resident on the model's device.
+# Rows [0, clip_row_count) are in use and row i is the embedding of clip_items_cache[i]. Rows of
+# updated or removed records stay behind as dead rows, masked out of every query until the next full load.
+clip_items_cache = None
+clip_position_by_path = None # Live rows only
+clip_vectors_cache = None # The normalized rows (with spare capacity) as numpy; shared with the matrix on CPU
+clip_matrix_cache = None
+clip_row_count = 0
+clip_dead_positions = None
+clip_scores_buffer = None # Reused for every exact query so scoring allocates nothing proportional to N
+clip_index_cache = None # IVFIndex over the same rows, for libraries of APPROXIMATE_SEARCH_MIN_RECORDS or more
+records_changed_since_full_load = 0
+search_index_lock = threading.RLock() # Queries hold this while reading the caches; updates while changing them
+index_refresh_lock = threading.Lock() # One reload or delta at a time
+# Search-as-you-type caches, least recently used first. Result sets are only valid for
+# the (index generation, known faces version) they were computed at.
+query_embedding_cache = OrderedDict() # {query: CLIP text embedding}
+query_results_cache = OrderedDict() # {(query_lower, top_k, exact): [(tier, results)]}
+query_results_version = None
+query_cache_lock = threading.Lock()
+
+def lru_get(cache, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def lru_put(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > QUERY_CACHE_SIZE:
+        cache.popitem(last=False)
+
+def encode_query(query):
+    """CLIP-encodes a query, reusing the embedding if it was typed recently."""
+    with query_cache_lock:
+        embedding = lru_get(query_embedding_cache, query)
+    if embedding is None:
+        embedding = clip_model_cache.encode(query, convert_to_tensor=True)
+        with query_cache_lock:
+            lru_put(query_embedding_cache, query, embedding)
+    return embedding
+
+def resident_clip_matrix(vectors):
+    """Copies normalized rows into the model's device; on CPU the tensor shares memory with `vectors`."""
+    device = clip_model_cache.device
+    dtype = torch.float32 if device.type == "cpu" else torch.float16 # Half precision only pays off on a GPU
+    return torch.from_numpy(vectors).to(device=device, dtype=dtype)
+
+def load_clip_matrix(store, records):
+    """Builds the resident, normalized CLIP matrix (and IVF index) for the given records."""
+    global clip_items_cache, clip_position_by_path, clip_vectors_cache, clip_matrix_cache
+    global clip_row_count, clip_dead_positions, clip_scores_buffer, clip_index_cache
+    items = [item for item in records if item['clip_row'] is not None]
+    vectors = np.zeros((int(len(items) * CLIP_SPARE_CAPACITY) + 16, store.clip_vectors.dim), dtype=np.float32)
+    if items:
+        vectors[:len(items)] = normalize_rows(store.clip_matrix()[[item['clip_row'] for item in items]])
+    matrix = resident_clip_matrix(vectors)
+
+    index = None
+    if store.clip_centroids is not None and len(items) >= APPROXIMATE_SEARCH_MIN_RECORDS:
+        index = IVFIndex(store.clip_centroids, vectors, [
+            item['ivf_list'] if item['ivf_list'] is not None else -1 for item in items
+        ], nprobe=IVF_NPROBE)
+
+    with search_index_lock:
+        clip_items_cache = items
+        clip_position_by_path = {item['file_path']: i for i, item in enumerate(items)}
+        clip_vectors_cache = vectors
+        clip_matrix_cache = matrix
+        clip_row_count = len(items)
+        clip_dead_positions = set()
+        clip_scores_buffer = torch.empty(len(vectors), device=matrix.device, dtype=matrix.dtype)
+        clip_index_cache = index
+
+def append_clip_rows(items):
+    """Adds rows for new or updated records, growing the resident matrix if it is full. Needs search_index_lock."""
+    global clip_vectors_cache, clip_matrix_cache, clip_row_count, clip_scores_buffer
+    vectors = normalize_rows(np.stack([item['clip_embedding'] for item in items]))
+    start, end = clip_row_count, clip_row_count + len(items)
+    if end > len(clip_vectors_cache):
+        grown = np.zeros((int(end * CLIP_SPARE_CAPACITY) + 16, clip_vectors_cache.shape[1]), dtype=np.float32)
+        grown[:start] = clip_vectors_cache[:start]
+        grown[start:end] = vectors
+        clip_vectors_cache = grown
+        clip_matrix_cache = resident_clip_matrix(grown)
+        clip_scores_buffer = torch.empty(len(grown), device=clip_matrix_cache.device, dtype=clip_matrix_cache.dtype)
+        if clip_index_cache is not None: clip_index_cache.vectors = grown
+    else:
+        clip_vectors_cache[start:end] = vectors
+        if clip_matrix_cache.data_ptr() != clip_vectors_cache.ctypes.data: # Separate copy on the GPU
+            clip_matrix_cache[start:end] = resident_clip_matrix(vectors)
+    for position, item in enumerate(items, start):
+        clip_items_cache.append(item)
+        clip_position_by_path[item['file_path']] = position
+    if clip_index_cache is not None:
+        clip_index_cache.add(np.arange(start, end))
+    clip_row_count = end
+
+def reload_search_index(store):
+    """Rebuilds every search cache from the store. Returns False if the index is empty."""
+    global record_by_id_cache, text_lower_by_id_cache, text_length_order_cache
+    global face_matrix_cache, face_owner_ids_cache, records_changed_since_full_load
+    records = store.load_records()
+    if not records:
+        return False
+    record_by_id = {item['id']: item for item in records}
+    text_lower_by_id = {item['id']: item['text'].lower() for item in records}
+    lengths = np.array([len(item['text']) for item in records])
+    order = np.argsort(lengths, kind='stable')
+    text_length_order = (lengths[order], np.array([item['id'] for item in records])[order])
+    face_matrix, face_owner_ids, _ = store.load_face_matrix()
+    load_clip_matrix(store, records)
+    with search_index_lock:
+        record_by_id_cache, text_lower_by_id_cache = record_by_id, text_lower_by_id
+        text_length_order_cache = text_length_order
+        face_matrix_cache, face_owner_ids_cache = face_matrix, face_owner_ids
+        records_changed_since_full_load = 0
+    return True
+
+def apply_index_changes(store, record_ids):
+    """
+    Patches the caches with the current state of the given records: new ones are
+    added, updated ones replaced and ones no longer in the store dropped.
+    Returns False, changing nothing, once so much has changed since the last
+    full load that reloading is cheaper than carrying the dead rows.
+    """
+    global text_length_order_cache, face_matrix_cache, face_owner_ids_cache, records_changed_since_full_load
+    if records_changed_since_full_load + len(record_ids) > DELTA_REBUILD_FRACTION * len(record_by_id_cache):
+        return False
+    records = store.load_records(record_ids=record_ids)
+    records_by_id = {item['id']: item for item in records}
+    changed_ids = np.array(record_ids, dtype=np.int64)
+    new_lengths = np.array([len(item['text']) for item in records], dtype=np.int64)
+    new_order = np.argsort(new_lengths, kind='stable')
+    new_faces = [(embedding, item['id']) for item in records for embedding in item['face_embeddings']]
+
+    with search_index_lock:
+        # Records and text. Updated records keep their place; new ids are always the largest.
+        new_clip_items = []
+        for record_id in record_ids:
+            old_item, item = record_by_id_cache.get(record_id), records_by_id.get(record_id)
+            if old_item is not None and old_item['file_path'] in clip_position_by_path:
+                clip_dead_positions.add(clip_position_by_path.pop(old_item['file_path']))
+            if item is None:
+                record_by_id_cache.pop(record_id, None)
+                text_lower_by_id_cache.pop(record_id, None)
+                continue
+            record_by_id_cache[record_id] = item
+            text_lower_by_id_cache[record_id] = item['text'].lower()
+            if item['clip_embedding'] is not None: new_clip_items.append(item)
+        if new_clip_items:
+            append_clip_rows(new_clip_items)
+
+        sorted_lengths, ids_by_length = text_length_order_cache
+        keep = ~np.isin(ids_by_length, changed_ids)
+        sorted_lengths, ids_by_length = sorted_lengths[keep], ids_by_length[keep]
+        insert_at = np.searchsorted(sorted_lengths, new_lengths[new_order], side='right')
+        new_ids = np.array([item['id'] for item in records], dtype=np.int64)
+        text_length_order_cache = (np.insert(sorted_lengths, insert_at, new_lengths[new_order]),
+                                   np.insert(ids_by_length, insert_at, new_ids[new_order]))
+
+        keep = ~np.isin(face_owner_ids_cache, changed_ids)
+        face_matrix, face_owner_ids = face_matrix_cache[keep], face_owner_ids_cache[keep]
+        if new_faces:
+            face_matrix = np.concatenate([face_matrix, np.array([embedding for embedding, _ in new_faces], dtype=face_matrix.dtype)])
+            face_owner_ids = np.concatenate([face_owner_ids, np.array([owner for _, owner in new_faces], dtype=np.int64)])
+        face_matrix_cache, face_owner_ids_cache = face_matrix, face_owner_ids
+        records_changed_since_full_load += len(record_ids)
+    return True
 
 def load_index_and_model_if_needed():
-    """Loads master index and CLIP model into cache."""
-    global clip_model_cache, master_index_cache
-    if master_index_cache is not None:
-        return True
-    
+    """
+    Loads the CLIP model and search caches, then keeps them current: when the store's
+    generation moves on, only the records that changed are patched in. Everything is
+    reloaded only after structural changes (compaction, IVF retraining) or large batches.
+    Returns False if there is nothing to search.
+    """
+    global clip_model_cache, master_index_generation
     try:
-        device = "mps" if torch.backends.mps.is_available() else "cpu"
-        clip_model_cache = SentenceTransformer(CLIP_MODEL_NAME, device=device)
-        with open(MASTER_INDEX_FILE, 'r', encoding='utf-8') as f:
-            master_index_cache = json.load(f)
-        return True
+        with index_refresh_lock:
+            store = get_store()
+            if clip_model_cache is None:
+                device = "mps" if torch.backends.mps.is_available() else "cpu"
+                clip_model_cache = SentenceTransformer(CLIP_MODEL_NAME, device=device)
+
+            if record_by_id_cache is not None:
+                generation, changed_ids = store.changes_since(master_index_generation)
+                if changed_ids is not None and (not changed_ids or apply_index_changes(store, changed_ids)):
+                    master_index_generation = generation
+                    return bool(record_by_id_cache)
+
+            generation = store.generation() # Read first: anything committed during the load is re-applied next time
+            if not reload_search_index(store):
+                return False
+            master_index_generation = generation
+            return True
     except Exception as e:
         print(f"Error loading master index: {e}")
         return False
 
-def perform_ultimate_search(query, top_k=10):
+def visual_search(query, top_k, excluded_paths, exact=False):
+    """
+    Returns [(score, item)] for the top-k CLIP matches, skipping `excluded_paths`.
+    Exact search is one matrix-vector product into a reused buffer plus topk;
+    excluded and dead rows are masked in place instead of building a subset.
+    """
+    query_embedding = encode_query(query)
+    with search_index_lock:
+        excluded_positions = [clip_position_by_path[path] for path in excluded_paths if path in clip_position_by_path]
+        excluded_positions.extend(clip_dead_positions)
+        k = min(top_k, clip_row_count - len(excluded_positions))
+        if k <= 0:
+            return []
+
+        if clip_index_cache is not None and USE_APPROXIMATE_VISUAL_SEARCH and not exact:
+            scores, positions = clip_index_cache.search(query_embedding.cpu().numpy(), k, np.array(excluded_positions))
+            return [(float(score), clip_items_cache[position]) for score, position in zip(scores, positions)]
+
+        query_vector = torch.nn.functional.normalize(query_embedding, dim=0).to(clip_matrix_cache.dtype)
+        scores = clip_scores_buffer[:clip_row_count]
+        torch.mv(clip_matrix_cache[:clip_row_count], query_vector, out=scores)
+        if excluded_positions:
+            scores.index_fill_(0, torch.tensor(excluded_positions, device=scores.device), float('-inf'))
+        top_scores, top_positions = torch.topk(scores, k)
+        return [(score, clip_items_cache[position]) for score, position in zip(top_scores.tolist(), top_positions.tolist())]
+
+def keyword_search(query_lower, within_ids=None):
     """
-    Performs a multi-modal search:
-    1. Checks if the query is a known person's name for a face search.
-    2. If not, performs a tiered Text > Fuzzy > Visual (CLIP) search.
+    Returns the records whose OCR text contains the query's words, using the
+    store's inverted index. Before the caches are loaded the matching records are
+    read straight from the store, so the first query doesn't wait for a full load.
+    Returns None if the index is unavailable and the caches aren't loaded to scan instead.
+    Without the index, the scan is limited to `within_ids` when given (see refinable_exact_ids).
     """
-    if not load_index_and_model_if_needed():
-        return {"error": "Could not load search index. Please run the indexer first."}
+    store = get_store()
+    matches = store.search_text(query_lower)
+    if matches is not None and record_by_id_cache is None:
+        records_by_id = {item['id']: item for item in store.load_records(
+            include_embeddings=False, record_ids=[record_id for record_id, _ in matches])}
+        return [records_by_id[record_id] for record_id, _ in matches if record_id in records_by_id]
+    with search_index_lock:
+        if record_by_id_cache is None:
+            return None
+        if matches is None:
+            scan_ids = record_by_id_cache if within_ids is None else [i for i in within_ids if i in record_by_id_cache]
+            return [record_by_id_cache[record_id] for record_id in scan_ids if query_lower in text_lower_by_id_cache[record_id]]
+        # Records committed after our last refresh are picked up on the next one
+        return [record_by_id_cache[record_id] for record_id, _ in matches if record_id in record_by_id_cache]
 
+def face_search(target_embeddings):
+    """
+    Returns the records containing a face within FACE_MATCH_TOLERANCE of any of a
+    person's sample embeddings, in index order, in one vectorized pass over every face.
+    """
+    with search_index_lock:
+        face_matrix, face_owner_ids = face_matrix_cache, face_owner_ids_cache # Replaced, never modified, by updates
+    if len(face_matrix) == 0:
+        return []
+    _, distances = nearest_faces(face_matrix, target_embeddings)
+    matched_ids = np.unique(face_owner_ids[distances <= FACE_MATCH_TOLERANCE])
+    with search_index_lock:
+        return [record_by_id_cache[record_id] for record_id in matched_ids.tolist() if record_id in record_by_id_cache]
+
+def fuzzy_min_shared_trigrams(query_length, distinct_trigrams):
+    """
+    A lower bound on how many of the query's distinct trigrams any text must
+    contain to reach partial_ratio >= FUZZY_MATCH_THRESHOLD. partial_ratio
+    compares the query with its best window of the text; turning the query into
+    that window with d deletions and i insertions destroys at most 3d + 2i
+    trigrams, so maximise that over every (d, i) the threshold allows.
+    """
+    min_ratio = (FUZZY_MATCH_THRESHOLD - 0.5) / 100 # partial_ratio rounds to an int
+    max_destroyed = 0
+    for deletions in range(query_length + 1):
+        for insertions in range(deletions + 1): # The window is never longer than the query
+            distance = deletions + insertions
+            if 1 - distance / (2 * query_length - deletions + insertions) >= min_ratio:
+                max_destroyed = max(max_destroyed, 3 * deletions + 2 * insertions)
+    return distinct_trigrams - max_destroyed
+
+def fuzzy_search(query_lower, excluded_paths, cancel_event=None):
+    """
+    Returns [(score, item)] for records with partial_ratio >= FUZZY_MATCH_THRESHOLD,
+    best first. The trigram index shortlists candidates with a bound that can never
+    drop a true match; every shortlisted record is scored exactly once.
+    Returns early (with partial results) once `cancel_event` is set.
+    """
+    candidate_ids = None
+    distinct_trigrams = len({query_lower[i:i + 3] for i in range(len(query_lower) - 2)})
+    min_shared = fuzzy_min_shared_trigrams(len(query_lower), distinct_trigrams)
+    if min_shared >= 1:
+        candidate_ids = get_store().trigram_candidates(query_lower, min_shared)
+    matches = []
+    with search_index_lock:
+        if candidate_ids is None:
+            candidate_ids = text_length_order_cache[1] # No usable bound: score everything
+        else:
+            # Texts shorter than the query are compared the other way round, so the bound doesn't apply to them
+            sorted_lengths, ids_by_length = text_length_order_cache
+            short_text_ids = ids_by_length[:np.searchsorted(sorted_lengths, len(query_lower))]
+            candidate_ids = np.union1d(candidate_ids, short_text_ids)
+
+        for position, record_id in enumerate(np.sort(candidate_ids).tolist()): # Index order, so ties keep their old order
+            if cancel_event is not None and position % CANCEL_CHECK_INTERVAL == 0 and cancel_event.is_set():
+                break
+            item = record_by_id_cache.get(record_id)
+            if item is None or item['file_path'] in excluded_paths:
+                continue
+            score = fuzz.partial_ratio(query_lower, text_lower_by_id_cache[record_id])
+            if score >= FUZZY_MATCH_THRESHOLD:
+                matches.append((score, item))
+    matches.sort(key=lambda match: match[0], reverse=True)
+    return matches
+
+def tagged_results(items, match_type, score):
+    results = []
+    for item in items:
+        item_copy = item.copy()
+        item_copy['match_type'], item_copy['score'] = match_type, score
+        results.append(item_copy)
+    return results
+
+def refinable_exact_ids(query_lower, top_k, exact):
+    """
+    Substring matching only narrows as the query grows, so when a cached query is a
+    prefix of this one its exact hits are a superset of this query's exact hits.
+    Returns their ids in index order (for the longest such prefix), or None.
+    Fuzzy and visual scores aren't monotonic in the query, so those tiers always rerun.
+    """
+    with query_cache_lock:
+        prefixes = [key[0] for key in query_results_cache
+                    if key[1:] == (top_k, exact) and query_lower.startswith(key[0]) and key[0] != query_lower]
+        if not prefixes:
+            return None
+        tiers = dict(query_results_cache[(max(prefixes, key=len), top_k, exact)])
+    if "exact" not in tiers:
+        return None
+    return sorted(item['id'] for item in tiers["exact"])
+
+def search_in_tiers(query, top_k=10, exact=False, cancel_event=None):
+    """
+    Like run_search_tiers, but replays a recent identical query from the result cache.
+    The cache is dropped whenever the index generation or the known faces change.
+    """
+    global query_results_version
+    key = (query.lower(), top_k, exact)
+    version = (get_store().generation(), face_logic.known_faces_version)
+    with query_cache_lock:
+        if query_results_version != version:
+            query_results_cache.clear()
+            query_results_version = version
+        cached = lru_get(query_results_cache, key)
+    if cached is not None:
+        yield from cached
+        return
+
+    tiers = []
+    for tier, results in run_search_tiers(query, top_k, exact, cancel_event):
+        tiers.append((tier, results))
+        yield tier, results
+    if tiers and tiers[-1][0] != "error" and not (cancel_event is not None and cancel_event.is_set()):
+        with query_cache_lock:
+            if query_results_version == version:
+                lru_put(query_results_cache, key, tiers)
+
+def run_search_tiers(query, top_k=10, exact=False, cancel_event=None):
+    """
+    Runs the multi-modal search one tier at a time, yielding (tier, results) as each finishes:
+    1. "face" if the query is a known person's name (the only tier in that case).
+    2. Otherwise "exact" keyword hits (best BM25 rank first), then "fuzzy", then "visual" (CLIP).
+    Yields ("error", message) if there is no index. Stops between tiers once `cancel_event` is set.
+    The visual tier uses the IVF index when one exists, unless `exact` is set.
+    """
+    cancelled = lambda: cancel_event is not None and cancel_event.is_set()
     query_lower = query.lower()
-    known_face_names, known_face_embeddings = load_known_faces()
+    known_faces = get_known_faces()
 
     # --- BRANCH 1: FACE SEARCH ---
-    if query_lower in known_face_names:
-        face_results = []
-        target_embedding = known_face_embeddings[known_face_names.index(query_lower)]
-        
-        for item in master_index_cache:
-            if not item['face_embeddings']:
-                continue
-            
-            unknown_embeddings = np.array(item['face_embeddings'])
-            # Compare the target face with all faces found in the screenshot
-            matches = np.linalg.norm(unknown_embeddings - target_embedding, axis=1) <= 0.6 # This is the tolerance
-            if np.any(matches):
-                item_copy = item.copy()
-                item_copy['match_type'] = f"Face Match: {query.capitalize()}"
-                item_copy['score'] = "High"
-                face_results.append(item_copy)
-        return face_results
+    if query_lower in known_faces:
+        if not load_index_and_model_if_needed():
+            yield "error", "Could not load search index. Please run the indexer first."
+            return
+        yield "face", tagged_results(face_search(known_faces[query_lower]), f"Face Match: {query.capitalize()}", "High")
+        return
 
     # --- BRANCH 2: TIERED KEYWORD AND VISUAL SEARCH ---
-    final_results = []
     found_paths = set()
 
-    # Tier 1: Exact Keyword
-    for item in master_index_cache:
-        if query_lower in item['text'].lower():
-            item_copy = item.copy()
-            item_copy['match_type'], item_copy['score'] = "Exact Keyword", "100%"
-            final_results.append(item_copy)
-            found_paths.add(item['file_path'])
+    # Tier 1: Exact Keyword. On the first query it is served straight from the store
+    # while the caches and CLIP model are still unloaded; later queries refresh first (a cheap delta).
+    index_ready = record_by_id_cache is not None and load_index_and_model_if_needed()
+    exact_items = keyword_search(query_lower)
+    if exact_items is None: # No full-text index: scan the caches once they are loaded
+        index_ready = load_index_and_model_if_needed()
+        exact_items = keyword_search(query_lower, refinable_exact_ids(query_lower, top_k, exact)) if index_ready else []
+    found_paths.update(item['file_path'] for item in exact_items)
+    yield "exact", tagged_results(exact_items, "Exact Keyword", "100%")
+    if cancelled(): return
+    if not index_ready and not load_index_and_model_if_needed():
+        yield "error", "Could not load search index. Please run the indexer first."
+        return
 
     # Tier 2: Fuzzy Keyword
-    fuzzy_matches = []
-    for item in master_index_cache:
-        if item['file_path'] not in found_paths and fuzz.partial_ratio(query_lower, item['text'].lower()) >= FUZZY_MATCH_THRESHOLD:
-            item_copy = item.copy()
-            item_copy['match_type'] = "Fuzzy Keyword"
-            item_copy['score'] = f"{fuzz.partial_ratio(query_lower, item['text'].lower())}%"
-            fuzzy_matches.append(item_copy)
-            found_paths.add(item['file_path'])
-    fuzzy_matches.sort(key=lambda x: int(x['score'][:-1]), reverse=True)
-    final_results.extend(fuzzy_matches)
+    fuzzy_matches = fuzzy_search(query_lower, found_paths, cancel_event)
+    if cancelled(): return
+    found_paths.update(item['file_path'] for _, item in fuzzy_matches)
+    yield "fuzzy", [result for score, item in fuzzy_matches for result in tagged_results([item], "Fuzzy Keyword", f"{score}%")]
+    if cancelled(): return
 
     # Tier 3: Visual Search (CLIP)
-    remaining_items = [item for item in master_index_cache if item['file_path'] not in found_paths]
-    if remaining_items:
-        clip_embeddings = torch.tensor([item['clip_embedding'] for item in remaining_items], device=clip_model_cache.device)
-        query_embedding = clip_model_cache.encode(query, convert_to_tensor=True)
-        
-        cosine_scores = util.cos_sim(query_embedding, clip_embeddings)[0]
-        top_results = torch.topk(cosine_scores, k=min(top_k, len(remaining_items)))
-
-        for score, idx in zip(top_results[0], top_results[1]):
-            match_item = remaining_items[idx.item()]
-            match_item['match_type'], match_item['score'] = "Visual Concept", f"{score.item():.2f}"
-            final_results.append(match_item)
-            
-    return final_results
\ No newline at end of file
+    visual_matches = visual_search(query, top_k, found_paths, exact)
+    yield "visual", [result for score, item in visual_matches for result in tagged_results([item], "Visual Concept", f"{score:.2f}")]
+
+def perform_ultimate_search(query, top_k=10, exact=False):
+    """
+    Performs a multi-modal search and returns every tier's results in one list:
+    a face search for a known person's name, otherwise Text > Fuzzy > Visual (CLIP).
+    """
+    final_results = []
+    for tier, results in search_in_tiers(query, top_k, exact):
+        if tier == "error":
+            return {"error": results}
+        final_results.extend(results)
+    return final_results
@@ -0,0 +1,97 @@
+import numpy as np
+
+# An IVF ("inverted file") index over normalized CLIP embeddings: k-means splits
+# the vectors into lists, and a query only scores the vectors in the few lists
+# whose centroids are closest to it. Built locally with numpy, no extra deps.
+
+KMEANS_SAMPLE_SIZE = 50_000
+KMEANS_ITERATIONS = 15
+ASSIGN_CHUNK_SIZE = 16_384
+NPROBE_FRACTION = 1 / 32 # Share of the lists a query scores by default; benchmarks/recall.py shows the recall/speed trade-off
+MIN_NPROBE = 8
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def choose_list_count(num_vectors):
+    return int(np.clip(4 * np.sqrt(num_vectors), 16, 4096))
+
+def train_centroids(vectors, num_lists, seed=0):
+    """Spherical k-means on a sample of the (already normalized) vectors."""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > KMEANS_SAMPLE_SIZE:
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), KMEANS_SAMPLE_SIZE, replace=False))])
+    else:
+        sample = np.asarray(vectors)
+    num_lists = min(num_lists, len(sample))
+    centroids = sample[rng.choice(len(sample), num_lists, replace=False)].copy()
+
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=num_lists)
+        empty = counts == 0
+        # Re-seed empty lists with random sample points so every list stays useful
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+def assign_lists(centroids, vectors):
+    """Returns the nearest list number for each (normalized) vector."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+        chunk = vectors[start:start + ASSIGN_CHUNK_SIZE]
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """
+    Query-side IVF index. `vectors` are the normalized embeddings in search
+    order and `list_ids` gives each one's list (-1 = not yet assigned, always scored).
+    `nprobe` is the number of lists scored per query; more is slower but misses fewer matches.
+    """
+
+    def __init__(self, centroids, vectors, list_ids, nprobe=None):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.nprobe = nprobe or max(MIN_NPROBE, int(len(centroids) * NPROBE_FRACTION))
+        list_ids = np.asarray(list_ids, dtype=np.int64)
+        order = np.argsort(list_ids, kind='stable')
+        sorted_ids = list_ids[order]
+        self.unassigned = order[sorted_ids < 0]
+        # CSR-style layout: positions of list i are members[offsets[i]:offsets[i + 1]]
+        self.members = order
+        self.offsets = np.searchsorted(sorted_ids, np.arange(len(centroids) + 1))
+
+    def add(self, positions):
+        """New rows are scored on every query until the index is next rebuilt."""
+        self.unassigned = np.concatenate([self.unassigned, np.asarray(positions, dtype=np.int64)])
+
+    def candidates(self, query):
+        probe = np.argsort(-(self.centroids @ query))[:self.nprobe]
+        parts = [self.members[self.offsets[i]:self.offsets[i + 1]] for i in probe]
+        parts.append(self.unassigned)
+        return np.concatenate(parts)
+
+    def search(self, query, k, excluded_positions=None):
+        """
+        Returns (scores, positions) of the approximate top-k by cosine similarity.
+        `excluded_positions` is an optional array of positions to skip.
+        """
+        query = normalize_rows(np.asarray(query).reshape(1, -1))[0]
+        candidates = self.candidates(query)
+        if excluded_positions is not None and len(excluded_positions):
+            candidates = candidates[~np.isin(candidates, excluded_positions)]
+        if len(candidates) == 0:
+            return np.empty(0, dtype=np.float32), candidates
+        scores = self.vectors[candidates] @ query
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return scores[top], candidates[top]
@@ -0,0 +1,134 @@
+import os
+import time
+import threading
+from .indexer import update_index_for_paths
+from .scanner import is_image_path, is_under
+from .index_store import APP_DIR
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.observers.polling import PollingObserver
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = PollingObserver = None
+    FileSystemEventHandler = object
+
+DEBOUNCE_SECONDS = 2.0 # Wait for a burst of events to go quiet before indexing
+MAX_DEBOUNCE_SECONDS = 10.0 # ...but never hold events back longer than this
+POLL_INTERVAL_SECONDS = 5.0
+
+
+class IndexingEventHandler(FileSystemEventHandler):
+    """Turns watchdog events into changed/deleted path notifications."""
+
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        self.watcher.record_change(event.src_path, event.is_directory)
+
+    def on_modified(self, event):
+        if not event.is_directory: # Directory mtimes change whenever a child does; the child has its own event
+            self.watcher.record_change(event.src_path, False)
+
+    def on_deleted(self, event):
+        self.watcher.record_deletion(event.src_path)
+
+    def on_moved(self, event):
+        self.watcher.record_deletion(event.src_path)
+        self.watcher.record_change(event.dest_path, event.is_directory)
+
+
+class FolderWatcher:
+    """
+    Watches the imported folders and feeds created, modified and deleted images
+    into the indexer incrementally. Uses the native file system observer
+    (inotify, FSEvents, ...) and falls back to polling if it is unavailable.
+    """
+
+    def __init__(self, roots, status_callback=None, on_index_updated=None):
+        self.roots = [root for root in roots if os.path.isdir(root)]
+        self.status_callback = status_callback
+        self.on_index_updated = on_index_updated
+        self.lock = threading.Lock()
+        self.changed_paths = set()
+        self.deleted_paths = set()
+        self.first_event_time = None
+        self.timer = None
+        self.observer = None
+
+    # --- Lifecycle ---
+    def start(self):
+        if Observer is None:
+            if self.status_callback: self.status_callback("❌ Watch mode needs the 'watchdog' package.")
+            return False
+        handler = IndexingEventHandler(self)
+        try:
+            self.observer = Observer()
+            for root in self.roots:
+                self.observer.schedule(handler, root, recursive=True)
+            self.observer.start()
+            mode = "native"
+        except Exception as e:
+            # e.g. the inotify watch limit was hit or the volume does not support events
+            print(f"⚠️ Native file watching failed ({e}); falling back to polling.")
+            self.observer = PollingObserver(timeout=POLL_INTERVAL_SECONDS)
+            for root in self.roots:
+                self.observer.schedule(handler, root, recursive=True)
+            self.observer.start()
+            mode = "polling"
+        if self.status_callback:
+            self.status_callback(f"👀 Watching {len(self.roots)} folders for new images ({mode}).")
+        return True
+
+    def stop(self):
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+        with self.lock:
+            if self.timer: self.timer.cancel()
+            self.timer = None
+
+    # --- Debouncing ---
+    def record_change(self, path, is_directory):
+        if (not is_directory and not is_image_path(path)) or is_under(path, APP_DIR):
+            return # Never index our own thumbnails
+        with self.lock:
+            self.deleted_paths.discard(path)
+            self.changed_paths.add(path)
+            self.schedule_flush()
+
+    def record_deletion(self, path):
+        with self.lock:
+            self.changed_paths.discard(path)
+            self.deleted_paths.add(path)
+            self.schedule_flush()
+
+    def schedule_flush(self):
+        # Called with self.lock held. Each event pushes the flush back, up to MAX_DEBOUNCE_SECONDS.
+        now = time.monotonic()
+        if self.first_event_time is None:
+            self.first_event_time = now
+        delay = min(DEBOUNCE_SECONDS, max(0.0, self.first_event_time + MAX_DEBOUNCE_SECONDS - now))
+        if self.timer: self.timer.cancel()
+        self.timer = threading.Timer(delay, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            changed, deleted = list(self.changed_paths), list(self.deleted_paths)
+            self.changed_paths.clear()
+            self.deleted_paths.clear()
+            self.first_event_time = None
+            self.timer = None
+        if not changed and not deleted:
+            return
+
+        indexed_count, removed_count = update_index_for_paths(changed, deleted, self.status_callback)
+        if indexed_count or removed_count:
+            if self.status_callback:
+                self.status_callback(f"👀 Watch mode: indexed {indexed_count} and removed {removed_count} files.")
+            if self.on_index_updated: self.on_index_updated()